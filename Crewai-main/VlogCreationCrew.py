@@ -1,27 +1,44 @@
 
 # 导入第三方库
+import json
 from crewai import Agent, Crew, Process, Task
 from crewai.project import CrewBase, agent, crew, task
-from crewai_tools import  ScrapeWebsiteTool
+from crewai.tasks.task_output import TaskOutput
 
 from utils.models import VlogConceptProposal,StoryboardOutline,VlogScript,PublishingOptimizationPlan
-from utils.jobManager import append_event
-from utils.tools import TavilySearchResults
+from utils.jobManager import append_event, save_checkpoint
+from utils.tools import shared_tools
+from utils.crewSetup import GuardedTask, load_crew_yaml
+from utils.jobControl import check_job
+from utils.tokenBudget import take_task_usage, task_usage_event
+from utils.structuredOutput import SchemaConverter
+from utils.streamEvents import tag_tasks, untag_tasks
 
 @CrewBase
 class VlogCreationCrew():
 	agents_config = 'crews/VlogCreationCrew/agents.yaml'
 	tasks_config = 'crews/VlogCreationCrew/tasks.yaml'
 	# 构造初始化函数，接受job_id作为参数，用于标识作业
-	def __init__(self, job_id, llm, inputData,crew_result=None):
+	# checkpoints 为作业已保存的检查点 {step: data}，其中已完成的任务不会重新执行
+	def __init__(self, job_id, llm, inputData,crew_result=None, checkpoints=None):
 		self.job_id = job_id
 		self.llm = llm
 		self.inputData = inputData
 		self.crew_result=crew_result
+		self.checkpoints = checkpoints or {}
 
-	# 定义task的回调函数，在任务完成后记录输出事件
+	# 任务输出的检查点名称，多平台作业按平台区分
+	def checkpoint_step(self, task_name):
+		return f"task:{self.inputData['target_platform']}:{task_name}"
+
+	# 定义task的回调函数，在任务完成后记录输出事件，并保存任务输出检查点（有结构化输出时保存校验后的 JSON）
 	def append_event_callback(self,task_output):
 		append_event(self.job_id, task_output.raw)
+		append_event(self.job_id, task_usage_event(task_output))
+		output = json.dumps(task_output.json_dict, ensure_ascii=False) if task_output.json_dict else task_output.raw
+		save_checkpoint(self.job_id, self.checkpoint_step(task_output.name), output)
+		# 任务之间检查作业是否已取消或超时（已完成的任务先保存检查点）
+		check_job(self.job_id)
 
 
 
@@ -32,7 +49,7 @@ class VlogCreationCrew():
 			config=self.agents_config['vlog_content_strategist'],
 			verbose=True,
 			llm=self.llm,
-			tools=[TavilySearchResults(), ScrapeWebsiteTool()],
+			tools=list(shared_tools()),
 		)
 	@agent
 	def creative_scriptwriter(self) -> Agent:
@@ -45,63 +62,123 @@ class VlogCreationCrew():
 
 
 	# 通过@task装饰器定义一个函数，返回一个Task实例
+	# name 固定为方法名，作为任务输出检查点的名称
+	# 执行顺序：概念 ->（故事结构 ∥ 发布优化）-> 脚本
+	# 发布优化只依赖概念，与故事结构并行执行；脚本任务开始前 crewai 会等待两个异步任务完成
+	# 异步任务使用 GuardedTask，任务出错时异常能传回 crew，不会让作业一直等待
+	# 输出不能直接解析为 JSON 时，SchemaConverter 先在本地修复并按模型校验，修复失败才让 LLM 重新转换
 	@task
 	def vlog_concept_task(self) -> Task:
 		return Task(
 			config=self.tasks_config['vlog_concept_task'],
+			name='vlog_concept_task',
 			callback=self.append_event_callback,
-			context=[self.crew_result],
-			output_json=VlogConceptProposal
+			output_json=VlogConceptProposal,
+			converter_cls=SchemaConverter
 		)
 
 	@task
 	def story_structure_task(self) -> Task:
-		return Task(
+		return GuardedTask(
 			config=self.tasks_config['story_structure_task'],
+			name='story_structure_task',
 			callback=self.append_event_callback,
 			context=[self.vlog_concept_task()],
-			output_json=StoryboardOutline
+			output_json=StoryboardOutline,
+			converter_cls=SchemaConverter,
+			async_execution=True
 		)
+
 	@task
-	def scriptwriting_task(self) -> Task:
-		return Task(
-			config=self.tasks_config['scriptwriting_task'],
+	def publishing_optimization_task(self) -> Task:
+		return GuardedTask(
+			config=self.tasks_config['publishing_optimization_task'],
+			name='publishing_optimization_task',
 			callback=self.append_event_callback,
-			context=[self.story_structure_task()],
-			output_json=VlogScript
+			context=[self.vlog_concept_task()],
+			output_json=PublishingOptimizationPlan,
+			converter_cls=SchemaConverter,
+			async_execution=True
 		)
 
 	@task
-	def publishing_optimization_task(self) -> Task:
+	def scriptwriting_task(self) -> Task:
 		return Task(
-			config=self.tasks_config['publishing_optimization_task'],
+			config=self.tasks_config['scriptwriting_task'],
+			name='scriptwriting_task',
 			callback=self.append_event_callback,
-			context=[self.scriptwriting_task()],
-			output_json=PublishingOptimizationPlan
+			context=[self.story_structure_task()],
+			output_json=VlogScript,
+			converter_cls=SchemaConverter
 		)
 
 
+	# Agent 每完成一步（包括每次工具调用）后检查作业是否已取消或超时
+	def check_job_callback(self, step_output):
+		check_job(self.job_id)
+
 	@crew
 	def crew(self) -> Crew:
 		return Crew(
 			agents=self.agents,
 			tasks=self.tasks,
 			process=Process.sequential,
+			step_callback=self.check_job_callback,
 			verbose=True
 		)
 
-	# 定义启动Crew的函数，接受输入参数inputs
+	# 汇总各任务的结构化输出 {任务名: 输出}，作为作业结果保存；无法解析为 JSON 的输出保留原文
+	def task_results(self, tasks):
+		results = {}
+		for task in tasks:
+			if task.output is None:
+				continue
+			output = task.output.json_dict
+			if output is None:
+				try:
+					output = json.loads(task.output.raw)
+				except json.JSONDecodeError:
+					output = task.output.raw
+			results[task.name] = output
+		return results
+
+	# 定义启动Crew的函数，接受输入参数inputs，返回各任务的结构化输出
 	def kickoff(self):
-		if not self.crew():
+		# 每次调用 self.crew() 都会重新创建全部 Agent 和 Task，只构建一次
+		crew = self.crew()
+		if not crew:
 			append_event(self.job_id, "VlogCreationCrew not set up")
 			return "VlogCreationCrew not set up"
+		tasks = list(crew.tasks)
+		# 恢复作业时，检查点中已完成的任务直接填入输出并从任务列表中移除，后续任务照常从它们的输出读取上下文
+		completed = [task for task in crew.tasks if self.checkpoint_step(task.name) in self.checkpoints]
+		if completed:
+			for task in completed:
+				task.output = TaskOutput(description=task.description, name=task.name, agent=task.agent.role,
+										 raw=self.checkpoints[self.checkpoint_step(task.name)])
+			remaining = [task for task in crew.tasks if task.output is None]
+			append_event(self.job_id, f"VlogCreationCrew resumed: {len(completed)} completed task(s) skipped")
+			if not remaining:
+				return self.task_results(tasks)
+			crew.tasks = remaining
 		append_event(self.job_id, "VlogCreationCrew's Task Started")
+		# 清零当前线程的 LLM 用量，之后任务回调记录的就是各任务自己的用量
+		take_task_usage()
+		# 多平台作业的各平台并行运行，流式事件按平台标注
+		tag_tasks(tasks, self.inputData['target_platform'])
 		try:
-			results = self.crew().kickoff(inputs=self.inputData)
+			# 趋势报告摘要只通过 {crew_result} 插值进入概念任务，之后的任务只接收上一步的结构化输出
+			crew.kickoff(inputs={**self.inputData, "crew_result": self.crew_result or ""})
 			append_event(self.job_id, "VlogCreationCrew's Task Complete")
 
-			return results
+			return self.task_results(tasks)
 		except Exception as e:
 			append_event(self.job_id, f"An error occurred: {e}")
-			return str(e)
+			# 交给 kickoff_flow 处理：瞬时错误自动重试，其余错误标记作业失败
+			raise
+		finally:
+			untag_tasks(tasks)
+
 
+# YAML 配置在进程内只解析一次，之后每个作业拿到一份副本
+VlogCreationCrew.load_yaml = staticmethod(load_crew_yaml)
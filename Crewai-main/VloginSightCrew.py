@@ -2,10 +2,13 @@
 # 导入第三方库
 from crewai import Agent, Crew, Process, Task
 from crewai.project import CrewBase, agent, crew, task
-from crewai_tools import SerperDevTool, ScrapeWebsiteTool
+from crewai_tools import SerperDevTool
 # 导入本应用程序提供的方法
 from utils.jobManager import append_event
-from utils.tools import TavilySearchResults
+from utils.tools import shared_tools
+from utils.crewSetup import load_crew_yaml
+from utils.jobControl import check_job
+from utils.tokenBudget import take_task_usage, task_usage_event
 
 @CrewBase
 class VloginSightCrew():
@@ -21,6 +24,9 @@ class VloginSightCrew():
 	# 定义task的回调函数，在任务完成后记录输出事件
 	def append_event_callback(self,task_output):
 		append_event(self.job_id, task_output.raw)
+		append_event(self.job_id, task_usage_event(task_output))
+		# 任务之间检查作业是否已取消或超时
+		check_job(self.job_id)
 
 	# 通过@agent装饰器定义一个函数，返回一个Agent实例
 	@agent
@@ -29,7 +35,7 @@ class VloginSightCrew():
 			config=self.agents_config['vlog_trend_analyst'],
 			verbose=True,
 			llm=self.llm,
-			tools=[TavilySearchResults(), ScrapeWebsiteTool()],
+			tools=list(shared_tools()),
 		)
 
 	@task
@@ -38,27 +44,40 @@ class VloginSightCrew():
 			config=self.tasks_config['trend_research_task'],
 			callback=self.append_event_callback,
 		)
+	# Agent 每完成一步（包括每次工具调用）后检查作业是否已取消或超时
+	def check_job_callback(self, step_output):
+		check_job(self.job_id)
+
 	@crew
 	def crew(self) -> Crew:
 		return Crew(
 			agents=self.agents,
 			tasks=self.tasks,
 			process=Process.sequential,
+			step_callback=self.check_job_callback,
 			verbose=True
 		)
 
 	# 定义启动Crew的函数，接受输入参数inputs
 	def kickoff(self):
-		if not self.crew():
+		# 每次调用 self.crew() 都会重新创建全部 Agent 和 Task，只构建一次
+		crew = self.crew()
+		if not crew:
 			append_event(self.job_id, "VloginSightCrew not set up")
 			return "VloginSightCrew not set up"
 		append_event(self.job_id, "VloginSightCrew's Task Started")
+		# 清零当前线程的 LLM 用量，之后任务回调记录的就是各任务自己的用量
+		take_task_usage()
 		try:
-			results = self.crew().kickoff(inputs=self.inputData)
+			results = crew.kickoff(inputs=self.inputData)
 			append_event(self.job_id, "VloginSightCrew's Task Complete")
 
 			return results
 		except Exception as e:
 			append_event(self.job_id, f"An error occurred: {e}")
-			return str(e)
+			# 交给 kickoff_flow 处理：瞬时错误自动重试，其余错误标记作业失败
+			raise
+
 
+# YAML 配置在进程内只解析一次，之后每个作业拿到一份副本
+VloginSightCrew.load_yaml = staticmethod(load_crew_yaml)
@@ -0,0 +1,51 @@
+# 作业准备开销基准测试：统计每个作业构建 Crew（解析 YAML、创建工具、实例化 Agent 和 Task）所需的时间
+# 用法（在 Crewai-main 目录下，不会调用大模型和搜索接口）：
+#   python benchmarks/bench_crew_setup.py --iterations 50
+# cold 模式每次都清空 YAML 和工具缓存，相当于改动前每个作业的开销；warm 模式为同一 worker 进程内的后续作业。
+# 改动前 kickoff 还会额外调用一次 self.crew()，实际开销约为 cold 结果的两倍。
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 只构建工具不发请求，没有配置时使用占位 Key
+os.environ.setdefault("TAVILY_API_KEY", "bench")
+
+from VloginSightCrew import VloginSightCrew
+from VlogCreationCrew import VlogCreationCrew
+from utils.crewSetup import _parse_yaml
+from utils.myLLM import my_llm
+from utils.tools import shared_tools
+
+
+# 构建一次两个 Crew，返回耗时（毫秒）
+def build_once(llm, cold: bool) -> float:
+    if cold:
+        _parse_yaml.cache_clear()
+        shared_tools.cache_clear()
+    inputData = {"target_platform": "小红书", "creator_niche": "城市周末探店 Vlog"}
+    started = time.perf_counter()
+    VloginSightCrew("bench", llm, inputData).crew()
+    VlogCreationCrew("bench", llm, inputData).crew()
+    return (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="crew setup overhead benchmark")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    llm = my_llm("deepseek", cache=False)
+    # 预热：首次构建包含模块级初始化
+    build_once(llm, cold=True)
+    for mode in ("cold", "warm"):
+        samples = [build_once(llm, cold=(mode == "cold")) for _ in range(args.iterations)]
+        print(f"{mode}: mean {statistics.mean(samples):.1f} ms, "
+              f"p50 {statistics.median(samples):.1f} ms, max {max(samples):.1f} ms per job")
+
+
+if __name__ == '__main__':
+    main()
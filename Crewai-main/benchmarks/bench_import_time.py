@@ -0,0 +1,51 @@
+# 启动导入耗时基准测试：用 python -X importtime 分别测量 API 入口（main）与 worker 入口（tasks）的导入时间
+# 用法（在 Crewai-main 目录下）：
+#   python benchmarks/bench_import_time.py
+#   python benchmarks/bench_import_time.py --modules main tasks --top 15
+# main 在拆分前会间接导入 tasks，因此拆分前两者的耗时相近；拆分后 main 只包含 FastAPI、Celery 客户端和作业存储。
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# 在独立进程中导入模块，解析 -X importtime 输出，返回 (总耗时微秒, [(累计耗时, 模块名)], 最大常驻内存 KB)
+def measure(module):
+    code = (
+        f"import {module}, resource, sys; "
+        "sys.stdout.write(str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))"
+    )
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+    top_level = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        # 嵌套导入的模块名带额外缩进；顶层模块的累计耗时之和即总导入耗时
+        if not name[1:].startswith(" "):
+            top_level.append((int(cumulative), name.strip()))
+    total = sum(cumulative for cumulative, _ in top_level)
+    return total, sorted(top_level, reverse=True), int(proc.stdout or 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="import-time benchmark")
+    parser.add_argument("--modules", nargs="+", default=["main", "tasks"])
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        total, top_level, max_rss = measure(module)
+        print(f"import {module}: {total / 1000:.0f} ms, max RSS {max_rss / 1024:.0f} MB")
+        for cumulative, name in top_level[:args.top]:
+            print(f"    {cumulative / 1000:>8.1f} ms  {name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# get_job_by_id 并发吞吐基准测试
+# 用法（在 Crewai-main 目录下，需要可用的 MySQL）：
+#   python benchmarks/bench_job_reads.py --threads 1 4 16 --seconds 5
+# "before" 模式用一把进程级全局锁包住每次调用，模拟移除 jobs_lock 之前的行为；
+# "after" 模式直接并发调用。两种模式下都有一个后台线程以固定速率 append_event，模拟运行中的作业；
+# 读取方像轮询的客户端一样带上 since 游标，只取新事件，结果不受事件表增长的影响。
+import argparse
+import os
+import sys
+import time
+from threading import Event, Lock, Thread
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.jobManager import append_event, create_job, flush_events, get_job_by_id, init_db
+
+global_lock = Lock()
+
+
+def run_readers(job_id, threads, seconds, use_lock, cursor, write_rate):
+    stop = Event()
+    counts = [0] * threads
+
+    def reader(index):
+        since = cursor
+        while not stop.is_set():
+            if use_lock:
+                with global_lock:
+                    job = get_job_by_id(job_id, since=since)
+            else:
+                job = get_job_by_id(job_id, since=since)
+            if job is not None and job.events:
+                since = job.events[-1].id
+            counts[index] += 1
+
+    def writer():
+        while not stop.wait(1 / write_rate):
+            if use_lock:
+                with global_lock:
+                    append_event(job_id, "benchmark event")
+            else:
+                append_event(job_id, "benchmark event")
+
+    workers = [Thread(target=reader, args=(i,)) for i in range(threads)]
+    workers.append(Thread(target=writer))
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="get_job_by_id concurrency benchmark")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--events", type=int, default=50, help="预先写入的事件数量")
+    parser.add_argument("--write-rate", type=float, default=20, help="运行中每秒追加的事件数量")
+    args = parser.parse_args()
+
+    init_db()
+    job_id = f"bench-{uuid4()}"
+    create_job(job_id)
+    for i in range(args.events):
+        append_event(job_id, f"seed event {i}")
+    flush_events()
+    # 各轮测试都从当前最后一个事件之后开始读取
+    cursor = get_job_by_id(job_id).events[-1].id if args.events else 0
+
+    print(f"{'threads':>8} {'before (req/s)':>16} {'after (req/s)':>16} {'speedup':>8}")
+    for threads in args.threads:
+        before = run_readers(job_id, threads, args.seconds, True, cursor, args.write_rate)
+        flush_events()
+        cursor = get_job_by_id(job_id).events[-1].id
+        after = run_readers(job_id, threads, args.seconds, False, cursor, args.write_rate)
+        flush_events()
+        cursor = get_job_by_id(job_id).events[-1].id
+        print(f"{threads:>8} {before:>16.1f} {after:>16.1f} {after / before:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
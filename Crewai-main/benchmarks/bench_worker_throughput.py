@@ -0,0 +1,62 @@
+# worker 吞吐基准测试：统计每个 worker 每分钟完成的作业数
+# 用法（在 Crewai-main 目录下，需要可用的 Redis、MySQL 和大模型 API Key）：
+#   1. 启动一个 worker，例如
+#        celery -A tasks worker --loglevel=info --pool=solo
+#        celery -A tasks worker --loglevel=info --pool=threads --concurrency=8
+#   2. python benchmarks/bench_worker_throughput.py --jobs 16 --workers 1
+# 分别在两种 pool 下运行，对比输出的 jobs/worker-minute。
+import argparse
+import os
+import sys
+import time
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 使用与 API 相同的 Celery 实例，按相同的优先级队列和 broker 传输配置投递
+from utils.celeryApp import app as celery_app, BATCH_PRIORITY, INTERACTIVE_PRIORITY
+from utils.jobManager import FINISHED_STATUSES, get_job_by_id, init_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Celery worker throughput benchmark")
+    parser.add_argument("--jobs", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1, help="参与消费的 worker 进程数")
+    parser.add_argument("--platform", default="小红书")
+    parser.add_argument("--niche", default="城市周末探店 Vlog")
+    parser.add_argument("--timeout", type=float, default=3600)
+    parser.add_argument("--batch", action="store_true", help="以批量优先级投递（默认为交互式优先级）")
+    args = parser.parse_args()
+
+    init_db()
+    priority = BATCH_PRIORITY if args.batch else INTERACTIVE_PRIORITY
+    run_id = uuid4().hex[:8]
+    job_ids = []
+    started = time.monotonic()
+    for i in range(args.jobs):
+        job_id = str(uuid4())
+        # 每个作业的描述略有不同，并强制重新调研，避免命中趋势报告缓存
+        inputData = {"target_platform": args.platform, "creator_niche": f"{args.niche}（基准 {run_id}-{i}）"}
+        celery_app.send_task('tasks.kickoff_flow', args=[job_id, inputData], kwargs={"force_refresh": True},
+                             priority=priority, task_id=job_id)
+        job_ids.append(job_id)
+
+    pending = set(job_ids)
+    statuses = {}
+    while pending and time.monotonic() - started < args.timeout:
+        time.sleep(5)
+        for job_id in list(pending):
+            job = get_job_by_id(job_id, with_result=False, with_events=False)
+            if job is not None and job.status in FINISHED_STATUSES:
+                statuses[job_id] = job.status
+                pending.discard(job_id)
+        print(f"{len(statuses)}/{args.jobs} finished after {time.monotonic() - started:.0f}s")
+
+    elapsed_minutes = (time.monotonic() - started) / 60
+    completed = sum(1 for status in statuses.values() if status == "COMPLETE")
+    print(f"completed={completed} errors={len(statuses) - completed} unfinished={len(pending)}")
+    print(f"elapsed={elapsed_minutes:.1f} min, {len(statuses) / elapsed_minutes / args.workers:.2f} jobs/worker-minute")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,109 @@
 
 import json
 from uuid import uuid4
-from threading import Thread
-import os
 import base64
 import uvicorn
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, UploadFile,File,Form
+from fastapi import FastAPI, HTTPException, Request, UploadFile,File,Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from utils.jobManager import get_job_by_id
-from tasks import app as celery_app
-from typing import Optional
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+import redis.asyncio as aioredis
+from utils.jobManager import create_job, get_job_by_id, get_jobs_status, init_db, FINISHED_STATUSES, STREAM_EVENT_PREFIX, \
+    decode_stream_event, load_checkpoints, save_checkpoint, update_job_by_id
+from utils.redisClient import REDIS_URL, job_channel
+from utils.jobControl import request_cancel
+from utils.singleFlight import claim_inflight, release_inflight, submission_key
+# 只导入轻量的 Celery 客户端投递任务，不导入 tasks（crewai、各 crew 及其工具依赖只在 worker 中加载）
+from utils.celeryApp import app as celery_app, BATCH_PRIORITY, INTERACTIVE_PRIORITY
+import re
+from typing import List, Optional, Union
 from dotenv import load_dotenv
-
-from dashscope import MultiModalConversation
 load_dotenv(override=True)
 
 
-QWEN_VL_API_KEY = os.getenv("QWEN_VL_API_KEY")
-os.environ["DASHSCOPE_API_KEY"] = QWEN_VL_API_KEY
 # 服务访问的端口
 PORT = 8012
+# 单个作业最多同时适配的平台数
+MAX_PLATFORMS = 5
+# 批量提交和批量查询一次最多处理的作业数
+MAX_BATCH_ITEMS = 200
+# 推送流在没有新消息时发送心跳并兜底查询一次数据库的间隔（秒）
+STREAM_HEARTBEAT_SECONDS = 15
+# 状态接口可选择返回的字段
+STATUS_FIELDS = ("status", "result", "events", "cursor")
 
 def image_to_base64(image_bytes: bytes) -> str:
     return base64.b64encode(image_bytes).decode("utf-8")
 
+
+# 解析目标平台列表：支持重复的表单字段，也支持用逗号、顿号分隔的单个字段，去重并保持顺序
+def parse_platforms(values: List[str]) -> List[str]:
+    platforms = []
+    for value in values:
+        for platform in re.split(r"[,，、;；]", value):
+            platform = platform.strip()
+            if platform and platform not in platforms:
+                platforms.append(platform)
+    return platforms
+
+
+# 校验目标平台并构造作业输入参数
+def build_input(target_platform: List[str], creator_niche: str) -> dict:
+    # 多个目标平台共享一次趋势调研，再分别生成各平台的内容
+    platforms = parse_platforms(target_platform)
+    if not platforms:
+        raise HTTPException(status_code=400, detail="目标平台不能为空")
+    if len(platforms) > MAX_PLATFORMS:
+        raise HTTPException(status_code=400, detail=f"一次最多支持 {MAX_PLATFORMS} 个目标平台")
+    return {
+        "target_platform": "、".join(platforms),
+        "target_platforms": platforms,
+        "creator_niche": creator_niche
+    }
+
+
+# 提交一个作业，返回 job_id；批量提交时传入 producer 复用同一个 broker 连接
+def submit_job(inputData: dict, image: Optional[dict] = None, image_bytes: Optional[bytes] = None,
+               force_refresh: bool = False, producer=None, priority: int = INTERACTIVE_PRIORITY) -> dict:
+    job_id = str(uuid4())
+
+    # 相同输入的作业正在运行时不再重复入队，新的 job_id 直接指向正在运行的作业，共享其事件和结果
+    inflight_key = None
+    if not force_refresh:
+        inflight_key = submission_key(inputData["target_platform"], inputData["creator_niche"], image_bytes)
+        leader_id = claim_inflight(inflight_key, job_id)
+        # 排队时被取消的作业不会运行，也就不会释放登记；已结束的作业不再作为合并对象
+        if leader_id is not None:
+            statuses = get_jobs_status([leader_id])
+            if statuses is None:
+                raise HTTPException(status_code=503, detail="作业存储暂不可用，请稍后重试")
+            if statuses.get(leader_id) in FINISHED_STATUSES:
+                release_inflight(inflight_key, leader_id)
+                leader_id = claim_inflight(inflight_key, job_id)
+        if leader_id is not None:
+            create_job(job_id, "PENDING", leader_id)
+            return {"job_id": job_id, "alias_of": leader_id}
+
+    # 提交时即创建作业记录，排队中的作业也可以查询和取消；Celery 任务 id 与 job_id 相同，取消时据此撤销排队中的任务
+    create_job(job_id, "PENDING")
+    try:
+        celery_app.send_task('tasks.kickoff_flow', args=[job_id, inputData],
+                             kwargs={"image": image, "force_refresh": force_refresh, "inflight_key": inflight_key},
+                             producer=producer, priority=priority, task_id=job_id)
+    except Exception as e:
+        # 入队失败的作业不会运行：释放登记，避免之后的相同提交一直合并到它上面
+        if inflight_key is not None:
+            release_inflight(inflight_key, job_id)
+        update_job_by_id(job_id, "ERROR", "Error", [f"Failed to enqueue job: {e}"])
+        raise
+    return {"job_id": job_id}
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # 启动时执行
+    # 启动时执行：创建数据库连接池并初始化库表
+    init_db()
     print("服务初始化完成")
     yield
     print("正在关闭...")
@@ -47,58 +123,30 @@ app.add_middleware(
 
 @app.post("/api/crewai")
 async def run_flow(
-        target_platform: str = Form(...),
+        target_platform: List[str] = Form(...),
         creator_niche: str = Form(...),
-        file: Optional[UploadFile] = File(None)
+        file: Optional[UploadFile] = File(None),
+        force_refresh: bool = Form(False)
 ):
     try:
-        final_description = creator_niche
+        inputData = build_input(target_platform, creator_niche)
 
-        # 如果上传了图片，调用 Qwen-VL 多模态 API
+        # 上传的图片不在请求线程中理解，而是随作业一起交给 Celery，由 worker 在流程第一步调用 Qwen-VL
+        image = None
+        image_bytes = None
         if file:
             image_bytes = await file.read()
             if not image_bytes:
                 raise HTTPException(status_code=400, detail="图片内容为空")
-
-            image_b64 = image_to_base64(image_bytes)
-
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"image": f"data:image/jpeg;base64,{image_b64}"},
-                        {"text": "请详细描述这张图片的内容，包括物体、场景、文字、风格等关键信息。"}
-                    ]
-                }
-            ]
+            # 入队前先缩放和重新编码，broker 和输入检查点中只保存缩小后的图片；Pillow 只在有图片的请求中导入
+            from utils.imaging import normalize_image
             try:
-                response = MultiModalConversation.call(
-                    model="qwen-vl-plus",
-                    messages=messages,
-                    api_key=QWEN_VL_API_KEY
-                )
-
-                if response.status_code != 200:
-                    raise Exception(f"API Error {response.code}: {response.message}")
-
-                image_desc = response.output.choices[0].message.content[0]["text"]
-                print("这个图片的内容是"+image_desc)
-                final_description = (
-                    f"用户原始描述：{creator_niche}\n\n"
-                    f"图片内容分析：{image_desc}"
-                )
-
+                normalized, mime_type = await run_in_threadpool(normalize_image, image_bytes)
             except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Qwen-VL 图像理解失败: {str(e)}")
+                raise HTTPException(status_code=400, detail=f"无法识别的图片：{e}")
+            image = {"data": image_to_base64(normalized), "mime_type": mime_type}
 
-        job_id = str(uuid4())
-        inputData = {
-            "target_platform": target_platform,
-            "creator_niche": final_description
-        }
-
-        celery_app.send_task('tasks.kickoff_flow', args=[job_id, inputData])
-        return {"job_id": job_id}
+        return await run_in_threadpool(submit_job, inputData, image, image_bytes, force_refresh)
 
     except HTTPException:
         raise
@@ -107,26 +155,250 @@ async def run_flow(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# GET接口 /api/crew/{job_id}，查询特定作业状态
-@app.get("/api/crewai/{job_id}")
-async def get_status(job_id: str):
-    job = get_job_by_id(job_id)
+# 批量提交的单个作业
+class BatchItem(BaseModel):
+    target_platform: Union[str, List[str]]
+    creator_niche: str
+    force_refresh: bool = False
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+
+
+# POST接口 /api/crewai/batch，一次提交多个作业，按提交顺序逐项返回 job_id 或入队失败的 error
+# 某一项入队失败不影响已入队的作业，客户端可以只重新提交失败的项
+@app.post("/api/crewai/batch")
+async def run_flow_batch(request: BatchRequest):
+    if not request.items:
+        raise HTTPException(status_code=400, detail="items 不能为空")
+    if len(request.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"一次最多提交 {MAX_BATCH_ITEMS} 个作业")
+
+    # 先校验全部输入，任一无效时整批都不入队
+    inputs = []
+    for index, item in enumerate(request.items):
+        platforms = [item.target_platform] if isinstance(item.target_platform, str) else item.target_platform
+        try:
+            inputs.append(build_input(platforms, item.creator_niche))
+        except HTTPException as e:
+            raise HTTPException(status_code=400, detail=f"items[{index}]: {e.detail}")
+
+    def submit_all():
+        results = []
+        # 整批作业共用一个 broker 连接入队，以批量优先级排在交互式作业之后
+        with celery_app.producer_or_acquire() as producer:
+            for index, (inputData, item) in enumerate(zip(inputs, request.items)):
+                try:
+                    results.append(submit_job(inputData, force_refresh=item.force_refresh, producer=producer,
+                                              priority=BATCH_PRIORITY))
+                except Exception as e:
+                    detail = e.detail if isinstance(e, HTTPException) else str(e)
+                    print(f"批量作业 items[{index}] 入队失败: {detail}")
+                    results.append({"error": detail})
+        return results
+
+    try:
+        return {"jobs": await run_in_threadpool(submit_all)}
+    except Exception as e:
+        print(f"批量启动作业时出错:\n\n {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# POST接口 /api/crewai/{job_id}/resume，让失败的作业从最后完成的步骤继续运行，已完成的 crew 和任务不会重新执行
+# 作业的截止时间从第一次开始运行时算起，恢复时默认沿用；new_deadline 为 True 时从恢复后开始运行时重新计时
+@app.post("/api/crewai/{job_id}/resume")
+async def resume_job(job_id: str, new_deadline: bool = False):
+    # 只需要状态，不读取结果和事件
+    job = await run_in_threadpool(get_job_by_id, job_id, None, False, False)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.job_id != job_id:
+        raise HTTPException(status_code=409, detail=f"该作业合并到了作业 {job.job_id}，请恢复该作业")
+    if job.status not in ("ERROR", "TIMEOUT"):
+        raise HTTPException(status_code=409, detail=f"只有失败或超时的作业可以恢复，当前状态为 {job.status}")
+    if job.status == "TIMEOUT" and not new_deadline:
+        raise HTTPException(status_code=409, detail="作业已超过截止时间，恢复时需要指定 new_deadline=true")
+    if not await run_in_threadpool(load_checkpoints, job_id, "input"):
+        raise HTTPException(status_code=409, detail="该作业没有保存检查点，无法恢复")
+
+    def resume():
+        if new_deadline:
+            # 清空开始时间，worker 开始运行时重新记录
+            save_checkpoint(job_id, "started_at", "")
+        update_job_by_id(job_id, "PENDING", "", ["Resume requested"])
+        celery_app.send_task('tasks.kickoff_flow', args=[job_id], kwargs={"resume": True},
+                             priority=INTERACTIVE_PRIORITY, task_id=job_id)
+
+    await run_in_threadpool(resume)
+    return {"job_id": job_id, "status": "PENDING"}
+
+
+# DELETE接口 /api/crewai/{job_id}，取消作业：撤销排队中的 Celery 任务，并通知运行中的作业在下一个检查点停止
+@app.delete("/api/crewai/{job_id}")
+async def cancel_job(job_id: str):
+    job = await run_in_threadpool(get_job_by_id, job_id, None, False, False)
     if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
+    if job.job_id != job_id:
+        # 合并到的作业可能还有其他提交者在等待结果，不随重复提交一起取消
+        raise HTTPException(status_code=409, detail=f"该作业合并到了作业 {job.job_id}，无法单独取消")
+    if job.status in FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail=f"作业已结束，当前状态为 {job.status}")
+
+    # 排队中或等待重试的作业没有 worker 在运行，直接记为取消；运行中的作业由 worker 停止后记录
+    queued = job.status in ("PENDING", "RETRYING")
+
+    def cancel():
+        request_cancel(job_id)
+        celery_app.control.revoke(job_id)
+        if queued:
+            update_job_by_id(job_id, "CANCELLED", "", ["Job cancelled before it started"])
+
+    await run_in_threadpool(cancel)
+    return {"job_id": job_id, "status": "CANCELLED" if queued else "CANCELLING"}
 
-    # 尝试解析作业结果为JSON格式
+
+# GET接口 /api/crewai?ids=a,b,c，一次查询多个作业的状态（单次数据库查询），不存在的作业返回 NOT_FOUND
+@app.get("/api/crewai")
+async def get_statuses(ids: str):
+    job_ids = list(dict.fromkeys(job_id.strip() for job_id in ids.split(",") if job_id.strip()))
+    if len(job_ids) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"一次最多查询 {MAX_BATCH_ITEMS} 个作业")
+    statuses = await run_in_threadpool(get_jobs_status, job_ids)
+    if statuses is None:
+        raise HTTPException(status_code=503, detail="作业存储暂不可用，请稍后重试")
+    return {"jobs": [{"job_id": job_id, "status": statuses.get(job_id, "NOT_FOUND")} for job_id in job_ids]}
+
+
+# 将事件列表转换为接口返回的 JSON 结构
+# kind 为 stream 的事件是 LLM 流式输出的片段，带有 call（单次调用 id）、task、platform；
+# 并行任务和多平台的片段会交织出现，同一 call 的片段按 id 顺序拼接即为该次调用的部分输出
+def serialize_events(events):
+    serialized = []
+    for event in events:
+        item = {"id": event.id, "timestamp": event.timestamp.isoformat(), "kind": "log", "data": event.data}
+        if event.data.startswith(STREAM_EVENT_PREFIX):
+            stream = decode_stream_event(event.data)
+            item.update(kind="stream", data=stream["text"], call=stream["call"], task=stream["task"],
+                        platform=stream["platform"])
+        serialized.append(item)
+    return serialized
+
+
+# 返回作业结果：优先使用结构化结果，旧作业的结果保存在 result 文本列中，尝试解析为 JSON
+def parse_result(job):
+    if job.result_data is not None:
+        return job.result_data
     try:
-        result_json = json.loads(str(job.result))
+        return json.loads(str(job.result))
     except json.JSONDecodeError:
-        result_json = str(job.result)
+        return str(job.result)
 
-    # 返回作业ID、状态、结果和事件的JSON响应
-    return {
-        "job_id": job_id,
-        "status": job.status,
-        "result": result_json,
-        "events": [{"timestamp": event.timestamp.isoformat(), "data": event.data} for event in job.events]
-    }
+
+# 按点分路径从结果中挑选部分内容，例如 ["小红书", "scriptwriting_task"]；不存在的路径忽略
+def select_result(result, paths):
+    selected = {}
+    for path in paths:
+        value, target = result, selected
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = value
+    return selected
+
+
+# GET接口 /api/crew/{job_id}，查询特定作业状态
+# since 为客户端上次收到的 cursor，传入后只返回更新的事件
+# fields 为逗号分隔的返回字段（status、result、events、cursor），result 可用点分路径只取一部分，
+# 例如 fields=status 只查询状态，fields=status,result.小红书.scriptwriting_task 只返回该平台的脚本
+@app.get("/api/crewai/{job_id}")
+async def get_status(job_id: str, since: Optional[int] = None, fields: Optional[str] = None):
+    selected = [field.strip() for field in (fields or ",".join(STATUS_FIELDS)).split(",") if field.strip()]
+    top_level = {field.split(".", 1)[0] for field in selected}
+    unknown = top_level - set(STATUS_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"未知字段：{', '.join(sorted(unknown))}")
+
+    # 只读取请求的字段所需的数据
+    job = await run_in_threadpool(get_job_by_id, job_id, since, "result" in top_level,
+                                  bool(top_level & {"events", "cursor"}))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    # 返回作业ID，以及请求的状态、结果、事件和下一次增量查询使用的游标
+    response = {"job_id": job_id}
+    if "status" in top_level:
+        response["status"] = job.status
+    if "result" in top_level:
+        result = parse_result(job)
+        paths = [field.split(".")[1:] for field in selected if field.startswith("result.")]
+        response["result"] = result if "result" in selected else select_result(result, paths)
+    if "events" in top_level:
+        response["events"] = serialize_events(job.events)
+    if "cursor" in top_level:
+        response["cursor"] = job.events[-1].id if job.events else (since or 0)
+    return response
+
+
+# GET接口 /api/crewai/{job_id}/stream，以 Server-Sent Events 推送作业的新事件和状态变化
+# worker 写入事件或更新状态后通过 Redis 发布通知，这里收到通知才增量查询一次数据库
+@app.get("/api/crewai/{job_id}/stream")
+async def stream_status(job_id: str, request: Request, since: Optional[int] = None):
+    # 推送过程中只读取状态和事件，结果在作业结束时读取一次
+    job = await run_in_threadpool(get_job_by_id, job_id, since, False)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    # 订阅实际运行的作业的频道（重复提交被合并时为被合并到的作业）
+    redis_client = aioredis.from_url(REDIS_URL, decode_responses=True)
+    pubsub = redis_client.pubsub()
+    await pubsub.subscribe(job_channel(job.job_id or job_id))
+
+    async def event_stream():
+        nonlocal job
+        cursor = since or 0
+        last_status = None
+        # 订阅建立前可能已有新事件，第一次推送快照后立即补查一次
+        catch_up = True
+        try:
+            while True:
+                if job is not None:
+                    if job.events:
+                        cursor = job.events[-1].id
+                    if job.events or job.status != last_status:
+                        last_status = job.status
+                        payload = {"job_id": job_id, "status": job.status, "events": serialize_events(job.events), "cursor": cursor}
+                        yield f"event: update\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                    if job.status in FINISHED_STATUSES:
+                        finished = await run_in_threadpool(get_job_by_id, job_id, None, True, False)
+                        payload = {"job_id": job_id, "status": job.status, "result": parse_result(finished or job), "cursor": cursor}
+                        yield f"event: end\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                        return
+
+                if await request.is_disconnected():
+                    return
+                if catch_up:
+                    catch_up = False
+                else:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=STREAM_HEARTBEAT_SECONDS)
+                    if message is None:
+                        # 长时间没有通知时发送心跳，并兜底查询一次以防通知丢失
+                        yield ": heartbeat\n\n"
+                    # 合并短时间内堆积的多条通知，只查询一次
+                    while message is not None:
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0)
+                job = await run_in_threadpool(get_job_by_id, job_id, cursor, False)
+        finally:
+            await pubsub.aclose()
+            await redis_client.aclose()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 if __name__ == '__main__':
     print(f"在端口 {PORT} 上启动服务器")
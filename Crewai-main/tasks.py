@@ -1,57 +1,229 @@
 
 import os
+import json
+import time
+import base64
+import random
+from concurrent.futures import ThreadPoolExecutor
 from crewai.flow.flow import Flow, listen, start
 from VloginSightCrew import VloginSightCrew
 from VlogCreationCrew import VlogCreationCrew
-from celery import Celery
-from utils.jobManager import append_event, get_job_by_id, update_job_by_id
-from utils.myLLM import my_llm
+from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
+from utils.celeryApp import app
+from utils.jobManager import append_event, create_job, flush_events, update_job_by_id, init_db, \
+    load_checkpoints, save_checkpoint
+from utils.jobControl import JobCancelled, check_job, clear_deadline, find_stop_reason, is_cancelled, start_deadline
+from utils.myLLM import my_llm, provider_llms
+from utils.singleFlight import release_inflight
+from utils.streamEvents import track_stream, untrack_stream
+from utils.trendStore import get_trend_report, save_trend_report
+from utils.tokenBudget import compact_report, count_tokens
 
 
+# 使用的大模型：deepseek、qwen，或 router（在两者之间按延迟路由）
+LLM_TYPE = os.getenv("LLM_TYPE", "router")
+# 瞬时错误（限流、超时、服务不可用）的自动重试次数
+TASK_MAX_RETRIES = int(os.getenv("TASK_MAX_RETRIES", "3"))
+# 重试的退避时间（秒）：第 n 次重试等待 base * 2^n，加随机抖动，不超过上限
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "30"))
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", "600"))
+# 视为瞬时错误的异常类型名（litellm 的服务商错误和本地限流等待超时），按名称匹配，避免依赖具体的异常模块路径
+TRANSIENT_ERRORS = {
+    "RateLimitError", "APIConnectionError", "APITimeoutError", "Timeout", "ServiceUnavailableError",
+    "InternalServerError", "BadGatewayError", "RateLimitExceeded",
+}
 
-# 创建 Celery 实例
-app = Celery('my_app', broker='redis://localhost:6379/3')
-LLM_TYPE = "qwen"
+
+# worker 进程启动时创建数据库连接池并初始化库表（threads/solo 池在首次访问数据库时创建）
+@worker_process_init.connect
+def init_worker(**kwargs):
+    init_db()
+
+
+# worker 进程关闭时写入尚未落库的事件（prefork 池的子进程触发 worker_process_shutdown，threads/solo 池触发 worker_shutdown）
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def shutdown_worker(**kwargs):
+    flush_events()
 
 # 定义flow
 class workFlow(Flow):
     # 构造初始化函数，接受job_id作为参数，用于标识作业
-    def __init__(self, job_id, llm, inputData):
+    # checkpoints 为作业已保存的检查点 {step: data}，重试或恢复时已完成的步骤直接使用检查点
+    def __init__(self, job_id, llm, inputData, image=None, force_refresh=False, checkpoints=None):
         super().__init__()
         self.job_id = job_id
         self.llm = llm
         self.inputData = inputData
+        self.image = image
+        # 为 True 时忽略已有的趋势报告，重新调研
+        self.force_refresh = force_refresh
+        self.checkpoints = checkpoints or {}
         self.crew_result=None
 
+    # 第一步：如果上传了图片，调用 Qwen-VL 理解图片并合并到创作者领域描述中
     @start()
+    def imageUnderstanding(self):
+        check_job(self.job_id)
+        if not self.image:
+            return None
+        if "imageUnderstanding" in self.checkpoints:
+            append_event(self.job_id, "Image Understanding skipped: restored from checkpoint")
+            self.inputData["creator_niche"] = self.checkpoints["imageUnderstanding"]
+            return self.checkpoints["imageUnderstanding"]
+        append_event(self.job_id, "Image Understanding Started")
+        # 多模态依赖（dashscope、Pillow）只在有图片的作业中才导入
+        from utils.vision import describe_image_cached, merge_description
+        try:
+            image_desc, cache_hit = describe_image_cached(base64.b64decode(self.image["data"]), self.image.get("mime_type"))
+        except Exception as e:
+            raise Exception(f"Qwen-VL 图像理解失败: {str(e)}")
+        if cache_hit:
+            append_event(self.job_id, "Image description served from cache")
+        append_event(self.job_id, f"图片内容分析：{image_desc}")
+        self.inputData["creator_niche"] = merge_description(self.inputData["creator_niche"], image_desc)
+        save_checkpoint(self.job_id, "imageUnderstanding", self.inputData["creator_niche"])
+        return image_desc
+
+    @listen(imageUnderstanding)
     def marketAnalystCrew(self):
+        check_job(self.job_id)
+        creator_niche = self.inputData["creator_niche"]
+        target_platform = self.inputData["target_platform"]
+        if "marketAnalystCrew" in self.checkpoints:
+            append_event(self.job_id, "VloginSightCrew skipped: trend report restored from checkpoint")
+            self.crew_result = self.checkpoints["marketAnalystCrew"]
+            return self.crew_result
+        # 同一领域和平台的趋势报告按天变化，新鲜度窗口内直接复用
+        if not self.force_refresh:
+            report = get_trend_report(creator_niche, target_platform)
+            if report is not None:
+                append_event(self.job_id, "VloginSightCrew skipped: trend report served from cache")
+                save_checkpoint(self.job_id, "marketAnalystCrew", report)
+                self.crew_result=report
+                return report
+
         result = VloginSightCrew(self.job_id, self.llm, self.inputData).kickoff()
+        # 只保存成功生成的报告，crew 未完成设置时 kickoff 返回的是错误信息字符串
+        if hasattr(result, "raw"):
+            save_trend_report(creator_niche, target_platform, result.raw)
+            save_checkpoint(self.job_id, "marketAnalystCrew", result.raw)
         self.crew_result=result
         return result
 
+    # 将趋势报告压缩为预算内的结构化摘要，VlogCreationCrew 只接收摘要，减少每个任务的输入 token
     @listen(marketAnalystCrew)
+    def trendDigest(self):
+        check_job(self.job_id)
+        report = str(getattr(self.crew_result, "raw", self.crew_result) or "")
+        digest = compact_report(report)
+        append_event(self.job_id, f"Trend report compacted: {count_tokens(report)} -> {count_tokens(digest)} tokens")
+        self.crew_result = digest
+        return digest
+
+    # 按目标平台生成内容：单个平台直接运行；多个平台共享上一步的趋势报告，各平台的 VlogCreationCrew 并行运行
+    @listen(trendDigest)
     def contentCreatorCrew(self):
-        result = VlogCreationCrew(self.job_id, self.llm, self.inputData,self.crew_result).kickoff()
-        return result
+        check_job(self.job_id)
+        platforms = self.inputData.get("target_platforms") or [self.inputData["target_platform"]]
+        # 结果统一为 {平台: {任务名: 结构化输出}}
+        if len(platforms) == 1:
+            result = VlogCreationCrew(self.job_id, self.llm, self.inputData,self.crew_result, self.checkpoints).kickoff()
+            return {platforms[0]: result}
+
+        def create_for_platform(platform):
+            append_event(self.job_id, f"Creating content for {platform}")
+            inputData = {**self.inputData, "target_platform": platform}
+            return VlogCreationCrew(self.job_id, self.llm, inputData, self.crew_result, self.checkpoints).kickoff()
+
+        with ThreadPoolExecutor(max_workers=len(platforms), thread_name_prefix=f"platform-{self.job_id[:8]}") as executor:
+            results = list(executor.map(create_for_platform, platforms))
+        return dict(zip(platforms, results))
+
+
+# 判断异常（包括被 crewai 包装后的原始异常）是否为可重试的瞬时错误
+def _is_transient(error):
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if type(error).__name__ in TRANSIENT_ERRORS:
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
 
 
 # 定义任务
-@app.task
-def kickoff_flow(job_id, inputData):
+# 每个步骤完成后保存检查点：Celery 重试、worker 异常退出后的重新投递，以及 resume 接口恢复的作业都从最后完成的步骤继续
+# resume 为 True 时作业输入从检查点读取，inputData 等参数可省略
+# 作业在流程步骤、任务、Agent 步骤之间以及等待大模型时检查取消标记和截止时间，被取消记为 CANCELLED，超时记为 TIMEOUT
+@app.task(bind=True, max_retries=TASK_MAX_RETRIES)
+def kickoff_flow(self, job_id, inputData=None, image=None, force_refresh=False, inflight_key=None, resume=False):
     print(f"Flow for job {job_id} is starting")
     results = None
+    retrying = False
     try:
-
-        append_event(job_id, "Flow Started")
-        results = workFlow(job_id, my_llm(LLM_TYPE), inputData).kickoff()
+        # 作业记录在提交时已创建，这里兼容直接投递的任务（重试和恢复时记录已存在）
+        create_job(job_id)
+        checkpoints = load_checkpoints(job_id)
+        # 截止时间从作业第一次开始运行时算起，保存在 started_at 检查点中，重试和恢复时不重新计时；
+        # 恢复接口在用户要求新的截止时间时把它清空
+        if not checkpoints.get("started_at"):
+            checkpoints["started_at"] = str(time.time())
+            save_checkpoint(job_id, "started_at", checkpoints["started_at"])
+        start_deadline(job_id, float(checkpoints["started_at"]))
+        # 排队期间已被取消或截止时间已过的作业不再运行
+        check_job(job_id)
+        if resume or inputData is None:
+            saved = json.loads(checkpoints["input"])
+            inputData, image, force_refresh = saved["inputData"], saved["image"], saved["force_refresh"]
+        elif "input" not in checkpoints:
+            save_checkpoint(job_id, "input", json.dumps(
+                {"inputData": inputData, "image": image, "force_refresh": force_refresh}, ensure_ascii=False))
+        # 输入和开始时间之外的检查点是已完成的步骤
+        completed = len(set(checkpoints) - {"input", "started_at"})
+        if completed:
+            update_job_by_id(job_id, "STARTED", "", [f"Flow Resumed from {completed} checkpoint(s)"])
+        else:
+            update_job_by_id(job_id, "STARTED", "", ["Flow Started"])
+        llm = my_llm(LLM_TYPE, job_id=job_id)
+        # LLM 的流式输出按节流间隔写入作业事件，用户无需等整个任务结束才能看到内容
+        track_stream(job_id, provider_llms(llm))
+        try:
+            results = workFlow(job_id, llm, inputData, image, force_refresh, checkpoints).kickoff()
+        finally:
+            # 写入剩余的流式片段，保证它们排在结束事件之前
+            untrack_stream(job_id)
         print(f"Crew for job {job_id} is complete", results)
 
 
     except Exception as e:
         print(f"Error in kickoff_flow for job {job_id}: {e}")
         append_event(job_id, f"An error occurred: {e}")
-        update_job_by_id(job_id, "ERROR", "Error", ["Flow Start Error"])
+        stop_reason = find_stop_reason(e)
+        # crewai 可能吞掉任务回调里抛出的取消异常，再以其他异常结束，以取消标记为准
+        if stop_reason is None and is_cancelled(job_id):
+            stop_reason = JobCancelled(f"Job {job_id} was cancelled")
+        if stop_reason is not None:
+            status = "CANCELLED" if isinstance(stop_reason, JobCancelled) else "TIMEOUT"
+            update_job_by_id(job_id, status, "", [str(stop_reason)])
+        elif _is_transient(e) and self.request.retries < TASK_MAX_RETRIES:
+            countdown = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** self.request.retries) * (1 + random.random() * 0.2)
+            update_job_by_id(job_id, "RETRYING", "", [f"Transient error, retrying in {countdown:.0f}s "
+                                                      f"({self.request.retries + 1}/{TASK_MAX_RETRIES})"])
+            retrying = True
+            # 重试沿用同一组参数重新投递，已完成的步骤由检查点跳过
+            raise self.retry(exc=e, countdown=countdown)
+        else:
+            update_job_by_id(job_id, "ERROR", "Error", ["Flow Start Error"])
+
+    else:
+        # 各平台、各任务的结构化输出压缩后保存到 result_blob，result 列只记录状态说明
+        update_job_by_id(job_id, "COMPLETE", "Complete", ["Flow complete"], result_data=results)
 
-    update_job_by_id(job_id, "COMPLETE", str(results), ["Flow complete"])
+    finally:
+        clear_deadline(job_id)
+        # 作业结束后释放运行中登记，之后相同的提交会重新运行；等待重试的作业仍在运行中，保留登记
+        if inflight_key and not retrying:
+            release_inflight(inflight_key, job_id)
 
-# celery -A tasks worker --loglevel=info --pool=solo
\ No newline at end of file
+# celery -A tasks worker --loglevel=info --pool=threads --concurrency=8
\ No newline at end of file
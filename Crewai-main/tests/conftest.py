@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试与 benchmarks 一样从 Crewai-main 目录导入 utils 等模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip("crewai")
+
+from utils.structuredOutput import _loads, extract_json
+
+
+# 字符串值中的 True/False/None、全角标点和 ",}" 不能被修复规则改写
+def test_repairs_do_not_touch_string_values():
+    text = '{"标题": "包含 True 的文本，以及：冒号", "说明": "None 或 False,]", "标签": ["a", "b",],}'
+    assert _loads(extract_json(text)) == {
+        "标题": "包含 True 的文本，以及：冒号",
+        "说明": "None 或 False,]",
+        "标签": ["a", "b"],
+    }
+
+
+def test_repairs_python_literals_outside_strings():
+    text = '{"可用": True, "备注": "True", "值": None}'
+    assert _loads(extract_json(text)) == {"可用": True, "备注": "True", "值": None}
+
+
+def test_repairs_full_width_separators_outside_strings():
+    text = '{"标题"： "你好，世界"， "标签"： ["旅行：周末"]}'
+    assert _loads(extract_json(text)) == {"标题": "你好，世界", "标签": ["旅行：周末"]}
+
+
+# 截断的回复补齐引号和括号，字符串中的括号不参与配对
+def test_extract_json_closes_truncated_output():
+    assert _loads(extract_json('前言 {"a": "x}", "b": ["y", "z')) == {"a": "x}", "b": ["y", "z"]}
@@ -0,0 +1,28 @@
+from utils.tokenBudget import compact_report, count_tokens
+
+
+# 标题很多的报告：标题也计入预算，摘要不能超过预算
+def test_compact_report_heading_heavy_within_budget():
+    report = "\n".join(f"## 趋势方向 {i}\n- 第 {i} 个方向的要点说明，包含具体的数据和案例。" for i in range(500))
+    result = compact_report(report, budget=200)
+    assert count_tokens(result) <= 200
+    assert result.startswith("## 趋势方向 0\n- ")
+
+
+# 只有以冒号结尾的短行（没有要点）的报告
+def test_compact_report_colon_headings_within_budget():
+    report = "\n".join(f"第 {i} 部分：" for i in range(500))
+    assert count_tokens(compact_report(report, budget=200)) <= 200
+
+
+# 列表符号开头、以冒号结尾的行是要点，不是标题
+def test_compact_report_bullet_with_colon_is_point():
+    report = "## 热门话题\n" + "\n".join(f"- 话题 {i}：" for i in range(200))
+    result = compact_report(report, budget=100)
+    assert result.startswith("## 热门话题\n- 话题 0：")
+    assert count_tokens(result) <= 100
+
+
+def test_compact_report_short_report_unchanged():
+    report = "## 趋势\n- 要点"
+    assert compact_report(report, budget=200) == report
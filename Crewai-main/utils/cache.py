@@ -0,0 +1,176 @@
+import os
+import time
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from threading import Lock
+
+# 磁盘缓存文件路径，同一台机器上的多个 Celery worker 共享同一个文件
+CACHE_DB_PATH = os.getenv(
+    "CACHE_DB_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "crewai_cache.sqlite3")
+)
+
+
+# 由多个字段生成缓存键：统一大小写并合并空白后取哈希
+def cache_key(*parts) -> str:
+    normalized = "|".join(" ".join(str(part).lower().split()) for part in parts)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+# 进程内的 LRU 缓存，带 TTL 过期，线程安全
+class LRUCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    # 读取缓存，过期或不存在时返回 None
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    # 写入缓存，超过容量时淘汰最久未使用的条目
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+# 基于 SQLite 的持久化缓存，按 namespace 区分不同用途，带 TTL 过期
+# 设置 max_entries 时按最近访问时间做 LRU 淘汰，控制缓存大小
+# 每次操作使用独立连接，可在多线程和多进程间安全共享
+class SqliteCache:
+    def __init__(self, namespace: str, ttl: float, path: str = CACHE_DB_PATH, max_entries: int = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = self._connect()
+        try:
+            # WAL 模式下读写互不阻塞，适合多个 worker 并发访问
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS cache (
+                        namespace TEXT NOT NULL,
+                        key TEXT NOT NULL,
+                        value TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        expires_at REAL NOT NULL,
+                        last_access REAL NOT NULL DEFAULT 0,
+                        PRIMARY KEY (namespace, key)
+                    )
+                ''')
+                # 兼容旧版本创建的缓存文件
+                columns = [row[1] for row in conn.execute("PRAGMA table_info(cache)")]
+                if "last_access" not in columns:
+                    conn.execute("ALTER TABLE cache ADD COLUMN last_access REAL NOT NULL DEFAULT 0")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache (namespace, last_access)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _count(self, hit: bool):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    # 读取缓存，过期或不存在时返回 None；max_age 可进一步限制条目的最长存活秒数
+    def get(self, key: str, max_age: float = None):
+        now = time.time()
+        min_created_at = now - max_age if max_age is not None else 0
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT value FROM cache WHERE namespace = ? AND key = ? AND expires_at > ? AND created_at >= ?",
+                (self.namespace, key, now, min_created_at)).fetchone()
+            # 启用 LRU 时记录访问时间
+            if row is not None and self.max_entries:
+                with conn:
+                    conn.execute("UPDATE cache SET last_access = ? WHERE namespace = ? AND key = ?",
+                                 (now, self.namespace, key))
+        finally:
+            conn.close()
+        self._count(row is not None)
+        return row[0] if row else None
+
+    # 写入缓存，并顺带清理本 namespace 下已过期以及超出容量的条目
+    def set(self, key: str, value: str):
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, created_at, expires_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.namespace, key, value, now, now + self.ttl, now))
+                conn.execute("DELETE FROM cache WHERE namespace = ? AND expires_at <= ?", (self.namespace, now))
+                if self.max_entries:
+                    conn.execute(
+                        "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                        "SELECT key FROM cache WHERE namespace = ? ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                        (self.namespace, self.namespace, self.max_entries))
+        finally:
+            conn.close()
+
+    # 列出最近访问的条目（不含缓存值本身），用于排查缓存内容
+    def entries(self, limit: int = 50) -> list:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT key, created_at, expires_at, last_access, LENGTH(value) FROM cache "
+                "WHERE namespace = ? ORDER BY last_access DESC LIMIT ?",
+                (self.namespace, limit)).fetchall()
+        finally:
+            conn.close()
+        return [{"key": row[0], "created_at": row[1], "expires_at": row[2], "last_access": row[3], "size": row[4]}
+                for row in rows]
+
+    # 删除指定条目；不传 key 时清空本 namespace 下的全部条目，返回删除的条数
+    def clear(self, key: str = None) -> int:
+        conn = self._connect()
+        try:
+            with conn:
+                if key is None:
+                    cursor = conn.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+                else:
+                    cursor = conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+                return cursor.rowcount
+        finally:
+            conn.close()
+
+    # 返回命中/未命中计数和当前条目数
+    def stats(self) -> dict:
+        conn = self._connect()
+        try:
+            entries = conn.execute("SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+        finally:
+            conn.close()
+        with self._stats_lock:
+            return {"namespace": self.namespace, "hits": self.hits, "misses": self.misses, "entries": entries}
@@ -0,0 +1,33 @@
+import os
+from celery import Celery
+from utils.redisClient import REDIS_URL
+
+# 作业优先级：Redis broker 下数值越小越先被消费
+# 交互式提交的单个作业排在批量作业之前，批量作业不会把交互式作业堵在队列后面
+INTERACTIVE_PRIORITY = int(os.getenv("INTERACTIVE_PRIORITY", "0"))
+BATCH_PRIORITY = int(os.getenv("BATCH_PRIORITY", "6"))
+# 未确认的作业消息在 Redis 中保留的秒数，超过后会被重新投递，应大于单个作业的最长运行时间
+BROKER_VISIBILITY_TIMEOUT = int(os.getenv("BROKER_VISIBILITY_TIMEOUT", str(4 * 3600)))
+
+# 创建 Celery 实例
+# API 进程只需要用它投递任务，不依赖 crew 相关模块；worker 通过 tasks.py 在同一个实例上注册任务
+app = Celery('my_app', broker=REDIS_URL)
+# worker 并发配置：作业几乎全部时间在等待 LLM 和搜索接口，使用线程池让一个 worker 同时运行多个作业
+# 命令行参数 --pool / --concurrency 会覆盖这里的默认值
+app.conf.update(
+    worker_pool=os.getenv("CELERY_POOL", "threads"),
+    worker_concurrency=int(os.getenv("CELERY_CONCURRENCY", "8")),
+    # 每个线程只预取一个作业，长作业不会囤积在某个 worker 上
+    worker_prefetch_multiplier=1,
+    # 作业完成后才确认消息，worker 进程异常退出时作业会被重新投递，并从检查点继续
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    # 按优先级拆分队列，worker 总是先取优先级高的队列；投递方和 worker 必须使用相同的配置
+    broker_transport_options={
+        "priority_steps": list(range(10)),
+        "sep": ":",
+        "queue_order_strategy": "priority",
+        "visibility_timeout": BROKER_VISIBILITY_TIMEOUT,
+    },
+    task_default_priority=INTERACTIVE_PRIORITY,
+)
@@ -0,0 +1,28 @@
+import copy
+from functools import lru_cache
+import yaml
+from crewai import Task
+
+
+# 按路径缓存解析后的 YAML 配置，每个 worker 进程只解析一次
+@lru_cache(maxsize=None)
+def _parse_yaml(path: str):
+    with open(path, "r", encoding="utf-8") as file:
+        return yaml.safe_load(file)
+
+
+# 替代 CrewBase 默认的 load_yaml：返回缓存配置的副本
+# CrewBase 会把配置里的 llm、tools 等名称就地替换为对象，共享同一份字典会相互污染，所以每次返回深拷贝
+def load_crew_yaml(config_path):
+    return copy.deepcopy(_parse_yaml(str(config_path)))
+
+
+# 可以异步执行的任务：crewai 0.x 的 Task._execute_task_async 不捕获异常，任务出错（服务商错误、作业取消或超时）时
+# future 永远不会完成，crew 会一直阻塞在 future.result() 上；这里把异常转交给 future，由 crew 在等待异步任务时重新抛出
+class GuardedTask(Task):
+    def _execute_task_async(self, agent, context, tools, future):
+        try:
+            super()._execute_task_async(agent, context, tools, future)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
@@ -0,0 +1,32 @@
+import os
+import io
+from PIL import Image
+
+# 发送给 VL 模型前图片的最长边（像素），更大的图片不会带来更好的描述
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1280"))
+# 重新编码为 JPEG 时的质量
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+
+# 规范化上传的图片：按最长边缩放，去除透明通道后重新编码，返回图片字节和对应的 MIME 类型
+# 只依赖 Pillow，API 进程在入队前调用，broker 和检查点中只保存缩小后的图片
+def normalize_image(image_bytes: bytes):
+    image = Image.open(io.BytesIO(image_bytes))
+    mime_type = Image.MIME.get(image.format, "image/jpeg")
+    # 尺寸合适的 JPEG 不需要重新编码
+    if image.format == "JPEG" and max(image.size) <= IMAGE_MAX_EDGE:
+        return image_bytes, mime_type
+
+    image.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.LANCZOS)
+    if image.mode in ("RGBA", "LA", "P"):
+        # 透明背景合成到白底上，避免转 JPEG 后变黑
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    return output.getvalue(), "image/jpeg"
@@ -0,0 +1,80 @@
+import os
+import time
+import logging
+import redis
+from threading import Lock
+from typing import Optional
+from utils.redisClient import get_redis
+
+# 取消标记的键前缀，API 写入、worker 检查
+CANCEL_PREFIX = "crewai:cancel:"
+# 取消标记的保留时间（秒）
+JOB_CANCEL_TTL = int(os.getenv("JOB_CANCEL_TTL", "86400"))
+# 单个作业从第一次开始运行起的最长墙钟时间（秒），Celery 重试和恢复不会重新计时，超时后作业停止并记为 TIMEOUT；0 表示不限制
+JOB_DEADLINE_SECONDS = float(os.getenv("JOB_DEADLINE_SECONDS", "1800"))
+# 等待大模型返回时检查取消和超时的间隔（秒）
+CANCEL_POLL_INTERVAL = float(os.getenv("CANCEL_POLL_INTERVAL", "1"))
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobTimeout(Exception):
+    pass
+
+
+# 本进程中正在运行的作业的截止时间 {job_id: monotonic 时间}
+_deadlines = {}
+_deadlines_lock = Lock()
+
+
+# 请求取消作业：写入取消标记，运行中的作业在下一个检查点停止
+def request_cancel(job_id: str):
+    get_redis().set(CANCEL_PREFIX + job_id, "1", ex=JOB_CANCEL_TTL)
+
+
+# 作业是否已被请求取消；Redis 不可用时视为未取消
+def is_cancelled(job_id: str) -> bool:
+    try:
+        return bool(get_redis().exists(CANCEL_PREFIX + job_id))
+    except redis.RedisError as e:
+        logging.warning(f"Error checking cancel flag for job {job_id}: {e}")
+        return False
+
+
+# 作业开始运行时登记截止时间；started_at 为作业第一次开始运行的时间（time.time()，保存在检查点中），
+# 重试和恢复时截止时间从它算起，只剩下尚未用完的部分
+def start_deadline(job_id: str, started_at: Optional[float] = None, seconds: float = JOB_DEADLINE_SECONDS):
+    elapsed = max(0.0, time.time() - started_at) if started_at is not None else 0.0
+    with _deadlines_lock:
+        _deadlines[job_id] = time.monotonic() + seconds - elapsed if seconds > 0 else None
+
+
+def clear_deadline(job_id: str):
+    with _deadlines_lock:
+        _deadlines.pop(job_id, None)
+
+
+# 检查作业是否需要停止：已超过截止时间抛出 JobTimeout，已被取消抛出 JobCancelled
+# 在流程步骤之间、任务之间、Agent 每一步（工具调用）之后以及等待大模型返回时调用
+def check_job(job_id: Optional[str]):
+    if not job_id:
+        return
+    with _deadlines_lock:
+        deadline = _deadlines.get(job_id)
+    if deadline is not None and time.monotonic() > deadline:
+        raise JobTimeout(f"Job {job_id} exceeded its deadline of {JOB_DEADLINE_SECONDS:.0f}s")
+    if is_cancelled(job_id):
+        raise JobCancelled(f"Job {job_id} was cancelled")
+
+
+# 在异常链中查找取消或超时异常（crewai 可能把原始异常包装后再抛出）
+def find_stop_reason(error) -> Optional[Exception]:
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, (JobCancelled, JobTimeout)):
+            return error
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return None
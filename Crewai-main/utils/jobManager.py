@@ -1,77 +1,178 @@
+import os
+import json
+import zlib
+import atexit
 import logging
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime
-from typing import List
-from threading import Lock
+from typing import List, Optional
+from threading import Lock, BoundedSemaphore, Condition, Thread
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, pooling
+from mysql.connector.errors import PoolError, InterfaceError, OperationalError
+from utils.redisClient import publish_job_update
 
 # 设置日志记录
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# 创建一个锁，用于保护数据库操作的线程安全
-jobs_lock = Lock()
-
-# 创建MySQL数据库连接函数，确保连接在操作前是可用的
-def get_db_connection():
-    try:
-        conn = mysql.connector.connect(
-            host='localhost',
-            user='root',
-            password='123456',
-        )
-        if conn.is_connected():
-            cursor = conn.cursor()
-            # 创建数据库（如果不存在）
-            cursor.execute("CREATE DATABASE IF NOT EXISTS crewai CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
-            cursor.close()
-            conn.close()
-
-            # 再次连接，这次指定数据库
-            conn = mysql.connector.connect(
-                host='localhost',
-                user='root',
-                password='123456',
-                database='crewai'
-            )
-            return conn
-    except Error as e:
-        logging.error(f"Error connecting to MySQL: {e}")
-        return None
-
-# 初始化连接
-conn = get_db_connection()
-if conn:
+# MySQL 连接配置，可通过环境变量覆盖
+DB_HOST = os.getenv("MYSQL_HOST", "localhost")
+DB_PORT = int(os.getenv("MYSQL_PORT", "3306"))
+DB_USER = os.getenv("MYSQL_USER", "root")
+DB_PASSWORD = os.getenv("MYSQL_PASSWORD", "123456")
+DB_NAME = os.getenv("MYSQL_DATABASE", "crewai")
+# 连接池大小（mysql-connector 单个连接池最多 32 个连接），应不小于 worker 并发数 + 1（事件写入线程）
+DB_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "10"))
+# 连接池耗尽时等待空闲连接的最长秒数
+DB_POOL_TIMEOUT = float(os.getenv("MYSQL_POOL_TIMEOUT", "10"))
+# 健康检查失败时的重连次数
+DB_RECONNECT_ATTEMPTS = int(os.getenv("MYSQL_RECONNECT_ATTEMPTS", "3"))
+# 使用纯 Python 实现的驱动；以 gevent 池运行 worker 时需要开启，C 扩展无法被 gevent 打补丁
+DB_USE_PURE = os.getenv("MYSQL_USE_PURE", "false").lower() == "true"
+# 事件缓冲区达到该条数时立即批量写入
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", "50"))
+# 事件缓冲区最长停留秒数，超过后即使未满也会写入
+EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", "0.5"))
+
+# 作业结束状态，进入这些状态后不会再有新事件
+FINISHED_STATUSES = ("COMPLETE", "ERROR", "CANCELLED", "TIMEOUT")
+# LLM 流式输出的片段事件以该前缀开头，与普通进度事件区分；前缀之后是带调用标识的 JSON（见 encode_stream_event）
+STREAM_EVENT_PREFIX = "[stream] "
+
+# 进程内共享的连接池，由 init_db 在启动时创建
+_pool = None
+_pool_init_lock = Lock()
+# mysql-connector 的连接池在耗尽时会直接抛错，这里用信号量让借用方排队等待
+_pool_slots = BoundedSemaphore(DB_POOL_SIZE)
+
+
+# 索引不存在时为已有表补建索引
+def _ensure_index(cursor, table: str, index: str, columns: str):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.statistics WHERE table_schema = %s AND table_name = %s AND index_name = %s LIMIT 1",
+        (DB_NAME, table, index))
+    if cursor.fetchone() is None:
+        logging.info(f"Creating index {index} on {table}{columns}")
+        cursor.execute(f"ALTER TABLE {table} ADD INDEX {index} {columns}")
+
+
+# 列不存在时为已有表补建列
+def _ensure_column(cursor, table: str, column: str, definition: str):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.columns WHERE table_schema = %s AND table_name = %s AND column_name = %s LIMIT 1",
+        (DB_NAME, table, column))
+    if cursor.fetchone() is None:
+        logging.info(f"Adding column {column} to {table}")
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+# 创建数据库和 jobs、events、checkpoints 表（如果它们不存在），只在启动时执行一次
+def _bootstrap_schema():
+    conn = mysql.connector.connect(
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASSWORD,
+    )
     cursor = conn.cursor()
-    # 创建 jobs 和 events 表（如果它们不存在）
     try:
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {DB_NAME} CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+        cursor.execute(f"USE {DB_NAME}")
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS jobs (
                 job_id VARCHAR(255) PRIMARY KEY,
                 status VARCHAR(50),
-                result TEXT
+                result TEXT,
+                alias_of VARCHAR(255) NULL,
+                result_blob LONGBLOB NULL
             )
         ''')
+        # 兼容已存在的旧表：补建 alias_of 列，合并重复提交的作业指向正在运行的作业
+        _ensure_column(cursor, "jobs", "alias_of", "VARCHAR(255) NULL")
+        # 补建 result_blob 列，保存压缩后的结构化结果；result 列只保留简短的状态说明
+        _ensure_column(cursor, "jobs", "result_blob", "LONGBLOB NULL")
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS events (
                 id INT AUTO_INCREMENT PRIMARY KEY,
                 job_id VARCHAR(255),
                 timestamp DATETIME,
                 data TEXT,
+                FOREIGN KEY (job_id) REFERENCES jobs(job_id),
+                INDEX idx_events_job_id_id (job_id, id)
+            )
+        ''')
+        # 兼容已存在的旧表：补建 (job_id, id) 复合索引，支持按作业增量读取事件
+        _ensure_index(cursor, "events", "idx_events_job_id_id", "(job_id, id)")
+        # 作业检查点：作业输入和每个已完成步骤的输出，重试或恢复时跳过已完成的步骤
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                job_id VARCHAR(255),
+                step VARCHAR(255),
+                data MEDIUMTEXT,
+                created_at DATETIME,
+                PRIMARY KEY (job_id, step),
                 FOREIGN KEY (job_id) REFERENCES jobs(job_id)
             )
         ''')
         conn.commit()
-    except Error as e:
-        logging.error(f"Error creating tables: {e}")
-else:
-    logging.critical("Failed to establish initial connection to MySQL.")
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# 初始化连接池和库表结构，重复调用时直接返回已创建的连接池
+def init_db():
+    global _pool
+    if _pool is not None:
+        return _pool
+    with _pool_init_lock:
+        if _pool is None:
+            try:
+                _bootstrap_schema()
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name="crewai_pool",
+                    pool_size=DB_POOL_SIZE,
+                    pool_reset_session=True,
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    database=DB_NAME,
+                    use_pure=DB_USE_PURE,
+                )
+                logging.info(f"MySQL connection pool created (size={DB_POOL_SIZE})")
+            except Error as e:
+                logging.critical(f"Failed to initialize MySQL connection pool: {e}")
+                raise
+    return _pool
+
+
+# 从连接池借出一个连接，借出前做健康检查，连接失效时自动重连；with 块结束后归还连接池
+@contextmanager
+def get_db_connection():
+    pool = init_db()
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise PoolError(f"No MySQL connection available within {DB_POOL_TIMEOUT}s")
+    try:
+        conn = pool.get_connection()
+        try:
+            conn.ping(reconnect=True, attempts=DB_RECONNECT_ATTEMPTS, delay=1)
+            yield conn
+        finally:
+            # 对池化连接调用 close 会把连接放回连接池，而不是断开
+            conn.close()
+    finally:
+        _pool_slots.release()
+
 
 # 定义一个 Event 类，表示事件的结构
 @dataclass
 class Event:
     timestamp: datetime
     data: str
+    # 事件自增 id，客户端可作为增量查询的游标
+    id: int = 0
 
 # 定义一个 Job 类，表示一个作业的结构
 @dataclass
@@ -79,130 +180,336 @@ class Job:
     status: str
     events: List[Event]
     result: str
+    # 实际产生事件和结果的作业 id；重复提交被合并时为被合并到的作业，否则为作业自身
+    job_id: str = ""
+    # 结构化结果（result_blob 解压后的 JSON），没有结构化结果的作业为 None
+    result_data: Optional[dict] = None
+
+# 事件批量写入器：append_event 只把事件放入内存缓冲区，由后台线程按条数或时间阈值用 executemany 批量写入
+class EventWriter:
+    def __init__(self, batch_size: int, flush_interval: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._cond = Condition()
+        # 保证各批次按入队顺序写入，事件 id 与追加顺序一致
+        self._flush_lock = Lock()
+        self._thread = None
+        self._stopped = False
+
+    # 追加一条事件到缓冲区，不访问数据库
+    def put(self, job_id: str, event_data: str):
+        with self._cond:
+            self._buffer.append((job_id, datetime.now(), event_data))
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="event-writer", daemon=True)
+                self._thread.start()
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+
+    def _run(self):
+        while not self._stopped:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._buffer) >= self.batch_size or self._stopped,
+                                    timeout=self.flush_interval)
+            self.flush()
+
+    # 用一条多行 INSERT 写入一组事件
+    def _insert(self, rows):
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.executemany("INSERT INTO events (job_id, timestamp, data) VALUES (%s, %s, %s)", rows)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    # 把缓冲区中的事件写入数据库，每条 INSERT 最多 batch_size 行，重试积压的事件时语句也不会超过 max_allowed_packet
+    def flush(self):
+        with self._flush_lock:
+            with self._cond:
+                batch, self._buffer = self._buffer, []
+            pending = [batch[i:i + self.batch_size] for i in range(0, len(batch), self.batch_size)]
+            written = []
+            while pending:
+                chunk = pending[0]
+                try:
+                    self._insert(chunk)
+                except (InterfaceError, OperationalError, PoolError) as e:
+                    # 连接类错误：尚未写入的事件放回缓冲区头部，下一轮重试
+                    rest = [row for rows in pending for row in rows]
+                    logging.error(f"Error flushing {len(rest)} events, will retry: {e}")
+                    with self._cond:
+                        self._buffer[:0] = rest
+                    break
+                except Error as e:
+                    # 其他错误（例如某个作业的记录创建失败导致外键约束失败）改为逐条写入，只丢弃出错的事件
+                    if len(chunk) > 1:
+                        logging.warning(f"Error flushing {len(chunk)} events, retrying one by one: {e}")
+                        pending[:1] = [[row] for row in chunk]
+                    else:
+                        logging.error(f"Error writing event for job {chunk[0][0]}, dropped: {e}")
+                        pending.pop(0)
+                    continue
+                written.extend(chunk)
+                pending.pop(0)
+            # 事件落库后通知订阅了这些作业的客户端
+            for job_id in dict.fromkeys(row[0] for row in written):
+                publish_job_update(job_id, "events")
+
+    # 停止后台线程并写入剩余事件
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+
+_event_writer = EventWriter(EVENT_BATCH_SIZE, EVENT_FLUSH_INTERVAL)
+# 进程退出时写入尚未落库的事件
+atexit.register(_event_writer.close)
+
+
+# 定义函数 create_job，在作业启动时创建一次 Job 记录，之后的事件不再逐条检查作业是否存在
+# alias_of 不为空时表示该作业是重复提交，不会实际运行，状态、事件和结果都取自 alias_of 指向的作业
+def create_job(job_id: str, status: str = 'STARTED', alias_of: Optional[str] = None):
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("INSERT IGNORE INTO jobs (job_id, status, result, alias_of) VALUES (%s, %s, %s, %s)",
+                               (job_id, status, '', alias_of))
+                conn.commit()
+            finally:
+                cursor.close()
+        if alias_of:
+            logging.info(f"Job {job_id} attached to running job {alias_of}")
+        else:
+            logging.info(f"Job {job_id} started")
+            publish_job_update(job_id, "status")
+
+    except Error as e:
+        logging.error(f"Error creating job {job_id}: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected error: {e}")
+
 
 # 定义函数 append_event，接受 job_id 和事件数据 event_data 作为参数
+# 事件先进入缓冲区，由 EventWriter 异步批量写入，调用方不会阻塞在 MySQL 上；作业需已通过 create_job 创建
 def append_event(job_id: str, event_data: str):
-    with jobs_lock:
-        try:
-            # 确保数据库连接有效
-            conn = get_db_connection()
-            if conn is None:
-                raise Exception("Database connection is not available.")
+    logging.info(f"Appending event for job {job_id}: {event_data}")
+    _event_writer.put(job_id, event_data)
 
-            cursor = conn.cursor()
 
-            # 检查 jobs 表中是否存在 job_id
-            cursor.execute("SELECT job_id FROM jobs WHERE job_id = %s", (job_id,))
-            job = cursor.fetchone()
-
-            if job is None:
-                # 如果不存在，创建一个新的 Job 记录
-                logging.info(f"Job {job_id} started")
-                cursor.execute("INSERT INTO jobs (job_id, status, result) VALUES (%s, %s, %s)",
-                               (job_id, 'STARTED', ''))
-            else:
-                logging.info(f"Appending event for job {job_id}: {event_data}")
-
-            # 创建一个新的 Event 记录
-            cursor.execute("INSERT INTO events (job_id, timestamp, data) VALUES (%s, %s, %s)",
-                           (job_id, datetime.now(), event_data))
-
-            # 提交事务以保存对数据库的更改
-            conn.commit()
-
-        except Error as e:
-            logging.error(f"Error appending event for job {job_id}: {e}")
-        except Exception as e:
-            logging.error(f"Unexpected error: {e}")
-        finally:
-            if conn.is_connected():
-                cursor.close()
-                conn.close()
+# 定义函数 flush_events，立即写入缓冲区中的全部事件（作业结束或进程关闭时调用）
+def flush_events():
+    _event_writer.flush()
 
 
-# 定义函数 update_job_by_id，根据 job_id 更新 status、result 和 events
-def update_job_by_id(job_id: str, status: str, result: str, event_data: List[str]):
-    with jobs_lock:
-        try:
-            # 确保数据库连接有效
-            conn = get_db_connection()
-            if conn is None:
-                raise Exception("Database connection is not available.")
+# 流式片段事件：call 为单次大模型调用的 id，task、platform 为发出调用的任务和平台，
+# 同一作业中并发的调用（并行任务、多平台）的片段交织写入时，客户端据此区分
+def encode_stream_event(text: str, call: Optional[str] = None, task: Optional[str] = None,
+                        platform: Optional[str] = None) -> str:
+    return STREAM_EVENT_PREFIX + json.dumps({"call": call, "task": task, "platform": platform, "text": text},
+                                            ensure_ascii=False)
 
-            cursor = conn.cursor()
 
-            # 检查 job_id 是否存在
-            cursor.execute("SELECT job_id FROM jobs WHERE job_id = %s", (job_id,))
-            job = cursor.fetchone()
+# 解析流式片段事件，返回 {call, task, platform, text}；旧版本写入的纯文本片段没有调用标识
+def decode_stream_event(data: str) -> dict:
+    body = data[len(STREAM_EVENT_PREFIX):]
+    try:
+        event = json.loads(body)
+    except json.JSONDecodeError:
+        event = None
+    if not isinstance(event, dict) or "text" not in event:
+        event = {"text": body}
+    return {"call": event.get("call"), "task": event.get("task"), "platform": event.get("platform"),
+            "text": event["text"]}
+
+
+# 结构化结果以 zlib 压缩的 JSON 保存
+def encode_result(result_data: Optional[dict]) -> Optional[bytes]:
+    if result_data is None:
+        return None
+    return zlib.compress(json.dumps(result_data, ensure_ascii=False).encode("utf-8"))
 
-            if job is None:
-                logging.warning(f"Job {job_id} not found. Cannot update.")
-                return
 
-            # 更新 job 的 status 和 result
-            cursor.execute("UPDATE jobs SET status = %s, result = %s WHERE job_id = %s",
-                           (status, result, job_id))
+def decode_result(blob: Optional[bytes]) -> Optional[dict]:
+    if blob is None:
+        return None
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
 
-            # 追加新的 event 数据
-            for event in event_data:
-                cursor.execute("INSERT INTO events (job_id, timestamp, data) VALUES (%s, %s, %s)",
-                               (job_id, datetime.now(), event))
 
-            # 提交更改
-            conn.commit()
+# 定义函数 update_job_by_id，根据 job_id 更新 status、result 和 events
+# result_data 为作业的结构化结果，压缩后写入 result_blob；不传时清空
+def update_job_by_id(job_id: str, status: str, result: str, event_data: List[str], result_data: Optional[dict] = None):
+    # 先写入缓冲区中的事件，保证结束事件排在作业过程事件之后
+    flush_events()
+    try:
+        # 从连接池借出连接
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                conn.start_transaction()
+                # 锁定该作业所在行，同一作业的并发更新在数据库层面串行化，其他作业不受影响
+                cursor.execute("SELECT job_id FROM jobs WHERE job_id = %s FOR UPDATE", (job_id,))
+                job = cursor.fetchone()
+
+                if job is None:
+                    conn.rollback()
+                    logging.warning(f"Job {job_id} not found. Cannot update.")
+                    return
+
+                # 更新 job 的 status 和 result
+                cursor.execute("UPDATE jobs SET status = %s, result = %s, result_blob = %s WHERE job_id = %s",
+                               (status, result, encode_result(result_data), job_id))
+
+                # 追加新的 event 数据，多行一次写入
+                now = datetime.now()
+                cursor.executemany("INSERT INTO events (job_id, timestamp, data) VALUES (%s, %s, %s)",
+                                   [(job_id, now, event) for event in event_data])
+
+                # 提交更改
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
 
-            logging.info(f"Job {job_id} updated successfully.")
+        logging.info(f"Job {job_id} updated successfully.")
+        publish_job_update(job_id, "status")
 
-        except Error as e:
-            logging.error(f"Error updating job {job_id}: {e}")
-        except Exception as e:
-            logging.error(f"Unexpected error: {e}")
-        finally:
-            if conn.is_connected():
-                cursor.close()
-                conn.close()
+    except Error as e:
+        logging.error(f"Error updating job {job_id}: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected error: {e}")
 
 
 # 定义函数 get_job_by_id，接受 job_id 作为参数，并返回 Job 对象
-def get_job_by_id(job_id: str) -> Job:
-    with jobs_lock:
-        try:
-            # 确保数据库连接有效
-            conn = get_db_connection()
-            if conn is None:
-                raise Exception("Database connection is not available.")
-
+# since 为客户端已见过的最后一个事件 id，传入时只返回比它更新的事件
+# with_result、with_events 为 False 时不读取结果和事件，只查询状态的调用方不必传输大段结果文本
+def get_job_by_id(job_id: str, since: Optional[int] = None, with_result: bool = True, with_events: bool = True) -> Job:
+    try:
+        # 从连接池借出连接
+        with get_db_connection() as conn:
             cursor = conn.cursor()
+            try:
+                # 只读的一致性快照事务：两次查询看到同一时刻的数据，且不阻塞并发写入
+                conn.start_transaction(consistent_snapshot=True, readonly=True)
+
+                # 从 jobs 表中检索作业的状态和结果；被合并的作业沿 alias_of 取被合并到的作业
+                result_columns = "COALESCE(l.result, j.result), COALESCE(l.result_blob, j.result_blob)" if with_result else "NULL, NULL"
+                cursor.execute(
+                    f"SELECT COALESCE(l.job_id, j.job_id), COALESCE(l.status, j.status), {result_columns} "
+                    "FROM jobs j LEFT JOIN jobs l ON l.job_id = j.alias_of WHERE j.job_id = %s", (job_id,))
+                job_data = cursor.fetchone()
+
+                if job_data is None:
+                    conn.rollback()
+                    logging.warning(f"Job {job_id} not found.")
+                    return None
+
+                # 按 (job_id, id) 索引检索该作业在游标之后的事件，按写入顺序返回
+                event_data = []
+                if with_events:
+                    cursor.execute("SELECT id, timestamp, data FROM events WHERE job_id = %s AND id > %s ORDER BY id",
+                                   (job_data[0], since or 0))
+                    event_data = cursor.fetchall()
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
 
-            # 从 jobs 表中检索作业的状态和结果
-            cursor.execute("SELECT status, result FROM jobs WHERE job_id = %s", (job_id,))
-            job_data = cursor.fetchone()
-
-            if job_data is None:
-                logging.warning(f"Job {job_id} not found.")
-                return None
+        # 将事件数据转换为 Event 对象的列表
+        events = [Event(id=row[0], timestamp=row[1], data=row[2]) for row in event_data]
 
-            # 从 events 表中检索与该作业相关的所有事件
-            cursor.execute("SELECT timestamp, data FROM events WHERE job_id = %s", (job_id,))
-            event_data = cursor.fetchall()
+        # 创建并返回 Job 对象
+        job = Job(status=job_data[1], events=events, result=job_data[2], job_id=job_data[0],
+                  result_data=decode_result(job_data[3]))
+        return job
 
-            # 将事件数据转换为 Event 对象的列表
-            events = [Event(timestamp=row[0], data=row[1]) for row in event_data]
+    except Error as e:
+        logging.error(f"Error retrieving job {job_id}: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected error: {e}")
 
-            # 创建并返回 Job 对象
-            job = Job(status=job_data[0], events=events, result=job_data[1])
-            return job
 
-        except Error as e:
-            logging.error(f"Error retrieving job {job_id}: {e}")
-        except Exception as e:
-            logging.error(f"Unexpected error: {e}")
-        finally:
-            if conn.is_connected():
+# 定义函数 get_jobs_status，一次查询多个作业的状态，返回 {job_id: status}，不存在的作业不在结果中
+# 查询出错时返回 None，调用方据此区分“作业不存在”和“数据库不可用”
+def get_jobs_status(job_ids: List[str]) -> dict:
+    if not job_ids:
+        return {}
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                placeholders = ", ".join(["%s"] * len(job_ids))
+                # 被合并的作业沿 alias_of 取被合并到的作业的状态
+                cursor.execute(
+                    "SELECT j.job_id, COALESCE(l.status, j.status) FROM jobs j "
+                    f"LEFT JOIN jobs l ON l.job_id = j.alias_of WHERE j.job_id IN ({placeholders})",
+                    tuple(job_ids))
+                rows = cursor.fetchall()
+                conn.commit()
+            finally:
                 cursor.close()
-                conn.close()
+        return {row[0]: row[1] for row in rows}
+
+    except Error as e:
+        logging.error(f"Error retrieving jobs status: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected error: {e}")
+    return None
+
 
+# 定义函数 save_checkpoint，保存作业某一步骤的输出；同一步骤重复保存时覆盖
+# 直接写库而不经过事件缓冲区，步骤完成后检查点立即可用
+def save_checkpoint(job_id: str, step: str, data: str):
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "INSERT INTO checkpoints (job_id, step, data, created_at) VALUES (%s, %s, %s, %s) "
+                    "ON DUPLICATE KEY UPDATE data = VALUES(data), created_at = VALUES(created_at)",
+                    (job_id, step, data, datetime.now()))
+                conn.commit()
+            finally:
+                cursor.close()
+        logging.info(f"Checkpoint {step} saved for job {job_id}")
 
+    except Error as e:
+        logging.error(f"Error saving checkpoint {step} for job {job_id}: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected error: {e}")
 
 
+# 定义函数 load_checkpoints，返回作业的全部检查点 {step: data}；传入 step 时只读取该步骤
+def load_checkpoints(job_id: str, step: Optional[str] = None) -> dict:
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                if step is None:
+                    cursor.execute("SELECT step, data FROM checkpoints WHERE job_id = %s", (job_id,))
+                else:
+                    cursor.execute("SELECT step, data FROM checkpoints WHERE job_id = %s AND step = %s", (job_id, step))
+                rows = cursor.fetchall()
+                conn.commit()
+            finally:
+                cursor.close()
+        return {row[0]: row[1] for row in rows}
 
+    except Error as e:
+        logging.error(f"Error loading checkpoints for job {job_id}: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected error: {e}")
+    return {}
@@ -1,7 +1,20 @@
 
 import os
+import json
+import time
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock
 from crewai import LLM
 from dotenv import load_dotenv
+from utils.cache import SqliteCache
+from utils.jobManager import append_event
+from utils.jobControl import CANCEL_POLL_INTERVAL, check_job
+from utils.rateLimiter import acquire
+from utils.streamEvents import CallAborted, CallWatch, check_call, stream_context, unwatch_call, watch_call
+from utils.tokenBudget import metered_call
 load_dotenv(override=True)
 
 
@@ -16,22 +29,342 @@ QWENAPI_API_BASE = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 QWENAPI_CHAT_API_KEY = QWEN_API_KEY
 QWENAPI_CHAT_MODEL = "openai/qwen-plus"
 
+# 是否以流式方式请求服务商，流式片段会被聚合后写入作业事件（见 utils/streamEvents.py）
+LLM_STREAM_ENABLED = os.getenv("LLM_STREAM_ENABLED", "true").lower() == "true"
+# 单次请求的超时时间（秒）；被放弃但无法中止的请求（未开启流式输出，或尚未收到首个片段）最多持续这么久
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "300"))
 
-# 定函数 模型初始化
-def my_llm(llmType):
+# LLM 响应缓存配置
+# 是否默认启用缓存
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true"
+# 缓存最多保留的条目数，超出后按最近访问时间淘汰
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2000"))
+# 条目过期时间（秒）
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 86400)))
+# 温度高于该值时输出本身就是随机的，默认不走缓存（force 时除外）
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.3"))
 
-    if llmType == "deepseek":
-        llm = LLM(
-            base_url=QWENAPI_API_BASE,
-            api_key=QWENAPI_CHAT_API_KEY,
-            model=QWENAPI_CHAT_MODEL,  # 本次使用的模型
-            temperature=0.7,
-        )
-    else:
-        llm = LLM(
+# 多服务商路由配置
+# 首选服务商开始请求后超过该秒数仍未响应（流式输出时为首个片段，否则为完整响应）时，向另一个服务商发出对冲请求
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "20"))
+# 统计延迟和错误率的滑动时间窗口（秒）
+LLM_STATS_WINDOW = float(os.getenv("LLM_STATS_WINDOW", "300"))
+# 错误率超过该值的服务商视为不健康，排到最后
+LLM_MAX_ERROR_RATE = float(os.getenv("LLM_MAX_ERROR_RATE", "0.5"))
+# 样本数少于该值时不判定健康状态
+LLM_MIN_SAMPLES = 3
+# 执行路由请求的线程池大小，进程内所有作业共享
+LLM_ROUTER_POOL_SIZE = int(os.getenv("LLM_ROUTER_POOL_SIZE", "16"))
+
+_llm_cache = SqliteCache("llm_response", LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES)
+_router_executor = ThreadPoolExecutor(max_workers=LLM_ROUTER_POOL_SIZE, thread_name_prefix="llm-router")
+
+
+# 各服务商的 LLM 配置
+def _provider_config(provider: str) -> dict:
+    if provider == "deepseek":
+        return dict(
             base_url=DEEPSEEK_API_BASE,  # 请求的API服务地址
             api_key=DEEPSEEK_CHAT_API_KEY,  # API Key
             model=DEEPSEEK_CHAT_MODEL,  # 本次使用的模型
-
+            stream=LLM_STREAM_ENABLED,
+            timeout=LLM_REQUEST_TIMEOUT,
         )
-    return llm
\ No newline at end of file
+    return dict(
+        base_url=QWENAPI_API_BASE,
+        api_key=QWENAPI_CHAT_API_KEY,
+        model=QWENAPI_CHAT_MODEL,  # 本次使用的模型
+        temperature=0.7,
+        stream=LLM_STREAM_ENABLED,
+        timeout=LLM_REQUEST_TIMEOUT,
+    )
+
+
+# 配置了 API Key 的服务商，参与路由
+def available_providers() -> list:
+    providers = []
+    if DEEPSEEK_CHAT_API_KEY:
+        providers.append("deepseek")
+    if QWENAPI_CHAT_API_KEY:
+        providers.append("qwen")
+    return providers
+
+
+# 单个服务商在滑动窗口内的请求延迟和成败记录，进程内所有作业共享，线程安全
+class ProviderStats:
+    def __init__(self, window: float):
+        self.window = window
+        self._samples = deque()
+        self._lock = Lock()
+
+    def _prune(self, now: float):
+        while self._samples and self._samples[0][0] < now - self.window:
+            self._samples.popleft()
+
+    def record(self, latency: float, ok: bool):
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, latency, ok))
+            self._prune(now)
+
+    # 返回 p50/p95 延迟（仅统计成功请求）、错误率和样本数
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._prune(time.monotonic())
+            latencies = sorted(latency for _, latency, ok in self._samples if ok)
+            total = len(self._samples)
+            errors = sum(1 for _, _, ok in self._samples if not ok)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "error_rate": errors / total if total else 0.0,
+            "samples": total,
+        }
+
+    def healthy(self, snapshot: dict) -> bool:
+        return snapshot["samples"] < LLM_MIN_SAMPLES or snapshot["error_rate"] <= LLM_MAX_ERROR_RATE
+
+
+_provider_stats = {name: ProviderStats(LLM_STATS_WINDOW) for name in ("deepseek", "qwen")}
+
+
+# 按健康状态和 p50 延迟给服务商排序：健康的在前，没有延迟样本的优先试探
+def rank_providers(providers: list) -> list:
+    def sort_key(name):
+        stats = _provider_stats[name]
+        snapshot = stats.snapshot()
+        return (not stats.healthy(snapshot), snapshot["p50"] or 0.0, snapshot["error_rate"])
+    return sorted(providers, key=sort_key)
+
+
+# 调用前先从服务商的令牌桶取令牌的 LLM，所有 worker 共享限流额度，避免并发作业一起触发 429
+class RateLimitedLLM(LLM):
+    def __init__(self, rate_limit_key: str, **kwargs):
+        super().__init__(**kwargs)
+        self.rate_limit_key = rate_limit_key
+
+    def call(self, messages, tools=None, *args, **kwargs):
+        # 输入 token 和耗时记入当前任务的用量（路由 LLM 内部的调用运行在路由线程上，不会重复计入任务）
+        def limited_call():
+            acquire(self.rate_limit_key)
+            # 等待令牌期间尝试可能已被路由放弃（作业停止、对冲落败），此时不再发出请求
+            check_call()
+            return super(RateLimitedLLM, self).call(messages, tools, *args, **kwargs)
+        return metered_call(messages, limited_call)
+
+
+# 在多个服务商之间按延迟路由的 LLM：请求发给最快的健康服务商，
+# 超过对冲延迟仍未响应时向下一个服务商发出重复请求，采用先返回的结果
+# 开启流式输出时以首个片段的到达作为已响应的依据，未开启时以完整响应返回为准；对冲计时从请求实际开始执行时算起
+class RoutingLLM(LLM):
+    def __init__(self, providers: list, job_id: str = None, hedge_delay: float = LLM_HEDGE_DELAY, **kwargs):
+        # 自身配置取第一个服务商，供 crewai 读取 model、上下文窗口等属性
+        super().__init__(**{**_provider_config(providers[0]), **kwargs})
+        self.providers = providers
+        self.job_id = job_id
+        self.hedge_delay = hedge_delay
+        self._llms = {name: RateLimitedLLM(rate_limit_key=name, **_provider_config(name)) for name in providers}
+        self._last_provider = None
+
+    def _log(self, message: str):
+        logging.info(f"LLM router: {message}")
+        if self.job_id:
+            append_event(self.job_id, f"LLM router: {message}")
+
+    def _timed_call(self, provider: str, watch: CallWatch, messages, tools, args, kwargs):
+        # 在线程池中排队期间已被放弃的尝试不再取令牌和发请求
+        if watch.aborted:
+            raise CallAborted()
+        llm = self._llms[provider]
+        # crewai 会在 Agent 上设置停止词，需要同步给实际发请求的 LLM
+        llm.stop = self.stop
+        # 计时包含等待限流令牌的时间，额度紧张的服务商会因延迟升高而被排到后面；在线程池中排队的时间不计入
+        start = time.monotonic()
+        watch.started_at = start
+        watch_call(watch)
+        try:
+            response = llm.call(messages, tools, *args, **kwargs)
+        except Exception:
+            _provider_stats[provider].record(time.monotonic() - start, False)
+            raise
+        finally:
+            unwatch_call()
+        _provider_stats[provider].record(time.monotonic() - start, True)
+        return response
+
+    def call(self, messages, tools=None, *args, **kwargs):
+        return metered_call(messages, lambda: self._route(messages, tools, args, kwargs))
+
+    def _route(self, messages, tools, args, kwargs):
+        check_job(self.job_id)
+        ranked = rank_providers(self.providers)
+        primary = ranked[0]
+        if primary != self._last_provider:
+            snapshot = _provider_stats[primary].snapshot()
+            self._log(f"routing to {primary} (p50={snapshot['p50']}, p95={snapshot['p95']}, "
+                      f"error_rate={snapshot['error_rate']:.2f})")
+            self._last_provider = primary
+
+        # 进行中的尝试 {future: (服务商, 进度)}，按发出顺序排列
+        pending = {}
+        # 尝试运行在路由线程上，发出调用的任务和平台在这里（任务线程上）取出，标注到它们的流式事件中
+        context = stream_context()
+
+        def launch(provider):
+            watch = CallWatch(context)
+            pending[_router_executor.submit(self._timed_call, provider, watch, messages, tools, args, kwargs)] = (provider, watch)
+
+        launch(primary)
+        backups = ranked[1:]
+        last_error = None
+        try:
+            while pending:
+                # 已有尝试开始流式返回时不再对冲，其余尝试立即放弃：不再写入片段，尚未开始的直接取消，
+                # 进行中的在下一个片段时中止，不会为同一次调用付出两份完整输出的 token 和限流额度
+                answered = next((watch for _, watch in pending.values() if watch.first_chunk.is_set()), None)
+                if answered is not None:
+                    for future, (_, watch) in list(pending.items()):
+                        if watch is not answered:
+                            watch.muted = True
+                            watch.aborted = True
+                            future.cancel()
+                            del pending[future]
+                # 对冲计时从最近一次尝试开始执行时算起，尚在线程池中排队的尝试不计时
+                provider, watch = list(pending.values())[-1]
+                hedge_at = None
+                if backups and answered is None and watch.started_at is not None:
+                    hedge_at = watch.started_at + self.hedge_delay
+
+                # 分段等待，每段结束检查作业是否已取消或超时；停止时不再等待进行中的请求，任务线程立即释放
+                timeout = CANCEL_POLL_INTERVAL
+                if hedge_at is not None:
+                    timeout = min(timeout, max(0.0, hedge_at - time.monotonic()))
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    check_job(self.job_id)
+                    # 最近一次尝试超过对冲延迟仍未响应，发出对冲请求
+                    if hedge_at is not None and time.monotonic() >= hedge_at and not watch.first_chunk.is_set():
+                        backup = backups.pop(0)
+                        waited_for = "first token" if self.stream else "response"
+                        self._log(f"no {waited_for} from {provider} within {self.hedge_delay}s, hedging to {backup}")
+                        launch(backup)
+                    continue
+                for future in done:
+                    provider, _ = pending.pop(future)
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        last_error = e
+                        logging.warning(f"LLM router: {provider} failed: {e}")
+                        continue
+                    if len(self.providers) > 1 and provider != primary:
+                        self._log(f"answer taken from {provider}")
+                    return response
+                # 已有请求失败，立即切换到下一个服务商
+                if backups:
+                    backup = backups.pop(0)
+                    self._log(f"failing over to {backup}")
+                    launch(backup)
+            raise last_error
+        finally:
+            # 返回或停止后仍在进行的尝试已被放弃：尚在排队的直接取消，等待令牌的不再发请求，进行中的在收到下一个片段时中止
+            for future, (_, watch) in pending.items():
+                watch.muted = True
+                watch.aborted = True
+                future.cancel()
+
+
+# 带响应缓存的 LLM：以模型、温度、停止词和完整消息列表为键，相同输入直接返回缓存的回复
+class CachingLLM(LLM):
+    def __init__(self, force_cache: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        # 为 True 时无视温度阈值始终使用缓存，适合 A/B 测试和重放
+        self.force_cache = force_cache
+
+    def _cacheable(self, tools) -> bool:
+        # 需要调用工具的请求会产生副作用，不缓存
+        if tools:
+            return False
+        if self.force_cache:
+            return True
+        # 未指定温度时使用服务商默认值（通常为 1.0），视为随机输出
+        return self.temperature is not None and self.temperature <= LLM_CACHE_MAX_TEMPERATURE
+
+    def call(self, messages, tools=None, *args, **kwargs):
+        if not self._cacheable(tools):
+            return super().call(messages, tools, *args, **kwargs)
+
+        # 对原始请求内容取哈希，不做大小写和空白归一化：只在大小写、缩进上不同的提示词（代码、JSON schema 等）不能共用回复
+        key = hashlib.sha256(json.dumps([self.model, self.temperature, self.stop, messages],
+                                        ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        cached = _llm_cache.get(key)
+        if cached is not None:
+            logging.info(f"LLM cache hit for {self.model}")
+            return cached
+
+        response = super().call(messages, tools, *args, **kwargs)
+        # 只缓存文本回复
+        if isinstance(response, str) and response:
+            _llm_cache.set(key, response)
+        return response
+
+
+# 查看 LLM 缓存的命中统计
+def llm_cache_stats() -> dict:
+    return _llm_cache.stats()
+
+
+# 列出最近访问的 LLM 缓存条目
+def llm_cache_entries(limit: int = 50) -> list:
+    return _llm_cache.entries(limit)
+
+
+# 清空 LLM 缓存，或只删除指定 key 的条目；返回删除的条数
+def flush_llm_cache(key: str = None) -> int:
+    return _llm_cache.clear(key)
+
+
+# 带响应缓存的路由 LLM：先查缓存，未命中时再路由到服务商
+class CachingRoutingLLM(CachingLLM, RoutingLLM):
+    pass
+
+
+# 带响应缓存的限流 LLM：缓存命中时不消耗令牌
+class CachingRateLimitedLLM(CachingLLM, RateLimitedLLM):
+    pass
+
+
+# 实际向服务商发请求的 LLM 实例，流式片段事件的来源是这些实例
+def provider_llms(llm) -> list:
+    if isinstance(llm, RoutingLLM):
+        return list(llm._llms.values())
+    return [llm]
+
+
+# 定函数 模型初始化
+# llmType 为 "router" 时返回在 DeepSeek 和通义千问之间按延迟路由的 RoutingLLM，job_id 用于记录路由事件
+# 指定了 job_id 的单一服务商 LLM 同样经由 RoutingLLM 发出请求，作业取消或超时时可以中止等待
+# cache 为 True 时返回带响应缓存的版本，force_cache 为 True 时忽略温度阈值始终缓存
+def my_llm(llmType, cache=LLM_CACHE_ENABLED, force_cache=False, job_id=None):
+    extra = {"force_cache": force_cache} if cache else {}
+
+    if llmType == "router" or job_id:
+        if llmType == "router":
+            providers = available_providers() or ["qwen"]
+        else:
+            providers = ["deepseek" if llmType == "deepseek" else "qwen"]
+        llm_cls = CachingRoutingLLM if cache else RoutingLLM
+        return llm_cls(providers=providers, job_id=job_id, **extra)
+
+    llm_cls = CachingRateLimitedLLM if cache else RateLimitedLLM
+    if llmType == "deepseek":
+        llm = llm_cls(rate_limit_key="deepseek", **_provider_config("deepseek"), **extra)
+    else:
+        llm = llm_cls(rate_limit_key="qwen", **_provider_config("qwen"), **extra)
+    return llm
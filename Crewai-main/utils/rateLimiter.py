@@ -0,0 +1,77 @@
+import os
+import time
+import random
+import logging
+import redis
+from utils.redisClient import get_redis
+
+# 是否启用跨 worker 的限流
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# 令牌桶键前缀，所有 worker 共享同一个 Redis 中的桶
+RATE_LIMIT_PREFIX = "crewai:ratelimit:"
+# 等待令牌的最长秒数，超过后抛出 RateLimitExceeded（路由 LLM 会因此切换到其他服务商）
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "120"))
+
+
+# 读取单个服务的限流配置：每秒补充的令牌数和桶容量（允许的突发请求数）
+# 环境变量示例：RATE_LIMIT_DEEPSEEK_RPS=3、RATE_LIMIT_DEEPSEEK_BURST=10
+def _limit(name: str, rps: float, burst: int) -> tuple:
+    prefix = f"RATE_LIMIT_{name.upper()}"
+    return float(os.getenv(f"{prefix}_RPS", str(rps))), int(os.getenv(f"{prefix}_BURST", str(burst)))
+
+
+# 各外部服务的限流配置
+RATE_LIMITS = {
+    "deepseek": _limit("deepseek", 3, 10),
+    "qwen": _limit("qwen", 3, 10),
+    "qwen_vl": _limit("qwen_vl", 1, 5),
+    "tavily": _limit("tavily", 1.5, 5),
+}
+
+# 令牌桶：按 Redis 服务器时间补充令牌，取到令牌返回 0，否则返回还需等待的毫秒数
+# 在 Redis 内原子执行，多个 worker 进程和线程之间不会超发
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return wait
+"""
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+# 从指定服务的令牌桶中取一个令牌，桶空时等待；未配置限流的服务直接放行
+# Redis 不可用时只记录日志并放行，限流失效不应导致作业失败
+def acquire(name: str, max_wait: float = RATE_LIMIT_MAX_WAIT):
+    if not RATE_LIMIT_ENABLED or name not in RATE_LIMITS:
+        return
+    rate, capacity = RATE_LIMITS[name]
+    deadline = time.monotonic() + max_wait
+    while True:
+        try:
+            wait_ms = get_redis().eval(_TOKEN_BUCKET_SCRIPT, 1, RATE_LIMIT_PREFIX + name, rate, capacity)
+        except redis.RedisError as e:
+            logging.warning(f"Rate limiter unavailable for {name}: {e}")
+            return
+        if not wait_ms:
+            return
+        # 加入随机抖动，避免多个等待者在同一时刻一起重试
+        delay = wait_ms / 1000 * (1 + random.random() * 0.2)
+        if time.monotonic() + delay > deadline:
+            raise RateLimitExceeded(f"rate limit for {name} not available within {max_wait}s")
+        time.sleep(delay)
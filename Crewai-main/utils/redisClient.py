@@ -0,0 +1,39 @@
+import os
+import json
+import logging
+import redis
+from threading import Lock
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+
+# Redis 地址，与 Celery broker 共用同一个实例
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/3")
+# 作业进度频道前缀，每个作业一个频道
+JOB_CHANNEL_PREFIX = "crewai:job:"
+
+_client = None
+_client_lock = Lock()
+
+
+# 获取进程内共享的 Redis 客户端（redis-py 客户端自带线程安全的连接池）
+def get_redis() -> redis.Redis:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _client
+
+
+# 返回作业进度频道名
+def job_channel(job_id: str) -> str:
+    return f"{JOB_CHANNEL_PREFIX}{job_id}"
+
+
+# 通知订阅者作业有新事件或状态变化；推送失败只记录日志，不影响数据库写入
+def publish_job_update(job_id: str, kind: str):
+    try:
+        get_redis().publish(job_channel(job_id), json.dumps({"job_id": job_id, "type": kind}))
+    except redis.RedisError as e:
+        logging.warning(f"Error publishing update for job {job_id}: {e}")
@@ -0,0 +1,41 @@
+import os
+import hashlib
+from typing import Optional
+from utils.cache import cache_key
+from utils.redisClient import get_redis
+
+# 运行中作业登记的键前缀
+INFLIGHT_PREFIX = "crewai:inflight:"
+# 登记的最长保留时间（秒），防止 worker 异常退出后登记永远不释放
+INFLIGHT_TTL = int(os.getenv("INFLIGHT_TTL", "3600"))
+
+# 仅当登记仍属于该作业时才删除，避免误删后来者的登记
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+# 由规范化后的输入生成提交指纹，带图片时加入图片内容哈希
+def submission_key(target_platform: str, creator_niche: str, image_bytes: Optional[bytes] = None) -> str:
+    image_hash = hashlib.sha256(image_bytes).hexdigest() if image_bytes else ""
+    return INFLIGHT_PREFIX + cache_key(target_platform, creator_niche, image_hash)
+
+
+# 尝试把 job_id 登记为该指纹的运行中作业；已有相同作业在运行时返回它的 job_id，否则返回 None
+def claim_inflight(key: str, job_id: str) -> Optional[str]:
+    client = get_redis()
+    if client.set(key, job_id, nx=True, ex=INFLIGHT_TTL):
+        return None
+    leader = client.get(key)
+    # 登记恰好在两次调用之间过期时，由本作业重新登记
+    if leader is None:
+        return claim_inflight(key, job_id)
+    return leader
+
+
+# 作业结束后释放登记，之后的相同提交会重新运行
+def release_inflight(key: str, job_id: str):
+    get_redis().eval(_RELEASE_SCRIPT, 1, key, job_id)
@@ -0,0 +1,195 @@
+import os
+import time
+from threading import Event, Lock, get_ident, local
+from uuid import uuid4
+from crewai.utilities.events import crewai_event_bus, LLMStreamChunkEvent, LLMCallCompletedEvent, LLMCallFailedEvent, \
+    TaskStartedEvent
+from utils.jobManager import append_event, encode_stream_event
+
+# 同一作业两次写入流式片段事件的最短间隔（毫秒），间隔内收到的片段先合并在内存中
+STREAM_FLUSH_MS = int(os.getenv("STREAM_FLUSH_MS", "1500"))
+
+
+# 单个作业的流式输出聚合器：按 LLM 实例和调用线程分别缓存片段，
+# 同一作业的多个并发调用（并行任务、多平台、对冲请求）输出不会交织在一起；距上次写入超过间隔时合并写入一条事件
+# 每条事件带有调用的 call、task、platform，客户端据此把交织的事件按调用拆开
+class StreamAggregator:
+    def __init__(self, job_id: str, interval: float):
+        self.job_id = job_id
+        self.interval = interval
+        self._buffers = {}
+        # 首个片段立即写入，缩短用户看到第一段内容的时间
+        self._last_flush = 0.0
+        self._lock = Lock()
+
+    def feed(self, source_key, meta: dict, chunk: str):
+        with self._lock:
+            self._buffers.setdefault(source_key, (meta, []))[1].append(chunk)
+            if time.monotonic() - self._last_flush < self.interval:
+                return
+            pending = self._drain()
+        self._write(pending)
+
+    # 丢弃某个调用尚未写入的片段
+    def discard(self, source_key):
+        with self._lock:
+            self._buffers.pop(source_key, None)
+
+    # 写入缓存的片段；不传 source_key 时写入全部调用的片段
+    def flush(self, source_key=None):
+        with self._lock:
+            pending = self._drain(source_key)
+        self._write(pending)
+
+    def _drain(self, source_key=None) -> list:
+        keys = list(self._buffers) if source_key is None else [source_key]
+        drained = [self._buffers.pop(key) for key in keys if key in self._buffers]
+        pending = [(meta, "".join(chunks)) for meta, chunks in drained]
+        pending = [(meta, text) for meta, text in pending if text]
+        if pending:
+            self._last_flush = time.monotonic()
+        return pending
+
+    def _write(self, pending: list):
+        for meta, text in pending:
+            append_event(self.job_id, encode_stream_event(text, **meta))
+
+
+# 中止被放弃的流式请求时在请求线程中抛出；继承 BaseException，不会被 crewai 事件总线和 LLM 内部的 except Exception 吞掉
+class CallAborted(BaseException):
+    pass
+
+
+# 路由请求单次尝试的进度，按发请求的线程登记：started_at 为开始执行的时间，first_chunk 在收到首个流式片段时置位；
+# muted 为 True 的尝试（对冲落败）不再写入流式事件；aborted 为 True 的尝试（已被放弃）在收到下一个片段时中止，
+# 流式响应随之关闭，不再占用路由线程和消耗 token
+# context 为发出调用的任务和平台（见 stream_context），与 call_id 一起写入这次尝试的流式事件
+class CallWatch:
+    def __init__(self, context: dict = None):
+        self.call_id = uuid4().hex[:12]
+        self.context = context or {}
+        self.started_at = None
+        self.first_chunk = Event()
+        self.muted = False
+        self.aborted = False
+
+
+# LLM 实例 id -> 所属作业的聚合器
+_aggregators = {}
+_aggregators_lock = Lock()
+# 线程 id -> 该线程上正在进行的尝试
+_watches = {}
+_watches_lock = Lock()
+# 任务 id -> 平台，由 crew 在运行期间登记
+_task_platforms = {}
+_task_platforms_lock = Lock()
+# 当前线程正在执行的任务和平台，任务开始时设置（异步任务运行在各自的线程上）
+_task_context = local()
+
+
+# 登记一组任务所属的平台，之后这些任务发出的调用的流式事件会标注平台
+def tag_tasks(tasks, platform: str):
+    with _task_platforms_lock:
+        for task in tasks:
+            _task_platforms[id(task)] = platform
+
+
+def untag_tasks(tasks):
+    with _task_platforms_lock:
+        for task in tasks:
+            _task_platforms.pop(id(task), None)
+
+
+# 返回当前线程正在执行的任务和平台 {task, platform}；路由在任务线程上调用，把它记录到尝试上
+def stream_context() -> dict:
+    return {"task": getattr(_task_context, "task", None), "platform": getattr(_task_context, "platform", None)}
+
+
+# 任务开始执行时记录任务名和平台，TaskStartedEvent 在执行任务的线程上发出
+@crewai_event_bus.on(TaskStartedEvent)
+def _on_task_started(source, event):
+    with _task_platforms_lock:
+        _task_context.platform = _task_platforms.get(id(source))
+    _task_context.task = getattr(source, "name", None)
+
+
+# 在当前线程上登记一次尝试，之后本线程收到的流式片段会更新它的状态
+def watch_call(watch: CallWatch):
+    with _watches_lock:
+        _watches[get_ident()] = watch
+
+
+def unwatch_call():
+    with _watches_lock:
+        _watches.pop(get_ident(), None)
+
+
+def _current_watch():
+    with _watches_lock:
+        return _watches.get(get_ident())
+
+
+# 当前线程上的尝试已被放弃时抛出 CallAborted；在真正发出请求前调用，已放弃的尝试不再发出请求
+def check_call():
+    watch = _current_watch()
+    if watch is not None and watch.aborted:
+        raise CallAborted()
+
+
+# 把作业使用的 LLM 实例登记到该作业的聚合器上，之后这些实例流式返回的片段会写入作业事件
+def track_stream(job_id: str, llms):
+    aggregator = StreamAggregator(job_id, STREAM_FLUSH_MS / 1000)
+    with _aggregators_lock:
+        for llm in llms:
+            _aggregators[id(llm)] = aggregator
+
+
+# 作业结束时写入剩余片段并取消登记
+def untrack_stream(job_id: str):
+    with _aggregators_lock:
+        keys = [key for key, aggregator in _aggregators.items() if aggregator.job_id == job_id]
+        aggregators = {_aggregators.pop(key) for key in keys}
+    for aggregator in aggregators:
+        aggregator.flush()
+
+
+def _aggregator_for(source):
+    with _aggregators_lock:
+        return _aggregators.get(id(source))
+
+
+@crewai_event_bus.on(LLMStreamChunkEvent)
+def _on_stream_chunk(source, event):
+    watch = _current_watch()
+    if watch is not None:
+        watch.first_chunk.set()
+    aggregator = _aggregator_for(source)
+    if watch is not None and watch.aborted:
+        if aggregator is not None:
+            aggregator.discard((id(source), get_ident()))
+        raise CallAborted()
+    if aggregator is None or not event.chunk:
+        return
+    if watch is not None and watch.muted:
+        aggregator.discard((id(source), get_ident()))
+        return
+    # 不经过路由的调用没有尝试记录，按 LLM 实例和线程生成调用 id，任务和平台取当前线程的
+    if watch is not None:
+        meta = {"call": watch.call_id, **watch.context}
+    else:
+        meta = {"call": f"{id(source):x}-{get_ident():x}", **stream_context()}
+    aggregator.feed((id(source), get_ident()), meta, event.chunk)
+
+
+# 一次调用结束后立即写入它剩余的片段，不必等到下一个片段到来
+@crewai_event_bus.on(LLMCallCompletedEvent)
+@crewai_event_bus.on(LLMCallFailedEvent)
+def _on_call_finished(source, event):
+    aggregator = _aggregator_for(source)
+    if aggregator is None:
+        return
+    watch = _current_watch()
+    if watch is not None and watch.muted:
+        aggregator.discard((id(source), get_ident()))
+    else:
+        aggregator.flush((id(source), get_ident()))
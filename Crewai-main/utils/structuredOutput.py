@@ -0,0 +1,179 @@
+import json
+import logging
+import re
+from threading import Lock
+from typing import Optional, Type
+from pydantic import BaseModel, ValidationError
+from crewai.utilities.converter import Converter
+from utils.jobManager import append_event
+from utils.tokenBudget import record_reask
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.S)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_PY_LITERAL = re.compile(r"\b(True|False|None)\b")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+# 进程内的结构化输出统计：本地修复成功次数和 LLM 重新转换次数
+_stats = {"repaired": 0, "reasks": 0}
+_stats_lock = Lock()
+
+
+def _count(kind: str):
+    with _stats_lock:
+        _stats[kind] += 1
+
+
+# 返回结构化输出的修复/重新转换计数
+def structured_output_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
+
+
+# 按 JSON 字符串字面量切分文本，返回 ([(是否为字符串, 片段)], 末尾的字符串是否未闭合)；字符串片段包含两端的引号
+def _segments(text: str):
+    segments, begin, in_string, escaped = [], 0, False, False
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+                segments.append((True, text[begin:index + 1]))
+                begin = index + 1
+        elif char == '"':
+            if index > begin:
+                segments.append((False, text[begin:index]))
+            begin, in_string = index, True
+    if begin < len(text):
+        segments.append((in_string, text[begin:]))
+    return segments, in_string
+
+
+# 只对字符串字面量之外的部分做替换，字符串值里的内容（中文标点、True 等单词）保持原样
+def _outside_strings(text: str, fix) -> str:
+    return "".join(segment if is_string else fix(segment) for is_string, segment in _segments(text)[0])
+
+
+# 从模型回复中取出 JSON 对象文本：去掉代码块标记，从第一个 { 开始按括号配对截取；
+# 回复被截断时补齐缺失的引号和括号
+def extract_json(text: str) -> Optional[str]:
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    start = text.find("{")
+    if start < 0:
+        return None
+
+    stack, offset = [], start
+    segments, in_string = _segments(text[start:])
+    for is_string, segment in segments:
+        if not is_string:
+            for index, char in enumerate(segment):
+                if char in "{[":
+                    stack.append("}" if char == "{" else "]")
+                elif char in "}]":
+                    if stack:
+                        stack.pop()
+                    if not stack:
+                        return text[start:offset + index + 1]
+        offset += len(segment)
+    return text[start:] + ('"' if in_string else "") + "".join(reversed(stack))
+
+
+def _strip_trailing_commas(segment: str) -> str:
+    return _TRAILING_COMMA.sub(r"\1", segment)
+
+
+# 依次尝试常见的格式问题修复，返回第一个能解析的结果；修复只作用于字符串字面量之外
+def _loads(candidate: str):
+    attempts = [
+        candidate,
+        # 末尾多余的逗号
+        _outside_strings(candidate, _strip_trailing_commas),
+        # 全角冒号、逗号被当作 JSON 分隔符
+        _outside_strings(candidate, lambda s: _strip_trailing_commas(s.replace("：", ":").replace("，", ","))),
+        # Python 字面量
+        _outside_strings(candidate, lambda s: _PY_LITERAL.sub(lambda m: _PY_LITERALS[m.group(1)],
+                                                              _strip_trailing_commas(s))),
+    ]
+    for attempt in attempts:
+        try:
+            return json.loads(attempt, strict=False)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+# 按模型字段做轻量的类型修正：外层多包了一层模型名时解包，列表字段给成字符串时按行拆分，超过 max_length 的列表截断
+def _coerce(data, model: Type[BaseModel]):
+    if isinstance(data, dict) and len(data) == 1 and not set(data) & set(model.model_fields):
+        inner = next(iter(data.values()))
+        if isinstance(inner, dict):
+            data = inner
+    if not isinstance(data, dict):
+        return data
+    data = dict(data)
+    for name, field in model.model_fields.items():
+        value = data.get(name)
+        if getattr(field.annotation, "__origin__", None) is not list:
+            continue
+        if isinstance(value, str):
+            value = [item.strip(" -•#") for item in re.split(r"[\n；;]", value) if item.strip(" -•#")]
+        max_length = next((meta.max_length for meta in field.metadata if getattr(meta, "max_length", None)), None)
+        if isinstance(value, list) and max_length and len(value) > max_length:
+            value = value[:max_length]
+        if value is not None:
+            data[name] = value
+    return data
+
+
+# 本地修复并按 Pydantic 模型校验，成功时返回模型实例，无法修复时返回 None
+def repair_output(text: str, model: Type[BaseModel]) -> Optional[BaseModel]:
+    candidate = extract_json(str(text))
+    if candidate is None:
+        return None
+    data = _loads(candidate)
+    if data is None:
+        return None
+    try:
+        return model.model_validate(_coerce(data, model))
+    except ValidationError:
+        return None
+
+
+# 结构化输出转换器：crewai 自带的 JSON 解析失败后先做本地修复和校验，
+# 只有修复失败时才走默认流程让 LLM 重新转换一次，并把重新转换计入任务用量
+class SchemaConverter(Converter):
+    def _local(self) -> Optional[BaseModel]:
+        repaired = repair_output(self.text, self.model)
+        if repaired is not None:
+            _count("repaired")
+            logging.info(f"Structured output for {self.model.__name__} repaired locally")
+        return repaired
+
+    def _reask(self, current_attempt: int):
+        _count("reasks")
+        record_reask()
+        message = f"Structured output for {self.model.__name__} re-asked (attempt {current_attempt})"
+        logging.warning(message)
+        job_id = getattr(self.llm, "job_id", None)
+        if job_id:
+            append_event(job_id, message)
+
+    def to_pydantic(self, current_attempt=1):
+        if current_attempt == 1:
+            repaired = self._local()
+            if repaired is not None:
+                return repaired
+        self._reask(current_attempt)
+        return super().to_pydantic(current_attempt)
+
+    def to_json(self, current_attempt=1):
+        if current_attempt == 1:
+            repaired = self._local()
+            if repaired is not None:
+                return json.dumps(repaired.model_dump(), ensure_ascii=False)
+        self._reask(current_attempt)
+        return super().to_json(current_attempt)
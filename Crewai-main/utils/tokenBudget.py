@@ -0,0 +1,156 @@
+import os
+import re
+import time
+from threading import local
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _encoding = None
+
+# 趋势报告摘要的 token 预算，VlogCreationCrew 的任务只看到摘要而不是完整报告
+TREND_DIGEST_TOKENS = int(os.getenv("TREND_DIGEST_TOKENS", "1200"))
+# 摘要中每个要点保留的最大 token 数，超出部分只保留第一句
+DIGEST_POINT_TOKENS = int(os.getenv("DIGEST_POINT_TOKENS", "80"))
+
+_CJK = re.compile(r"[　-〿一-鿿＀-￯]")
+# 标题行：Markdown 标题、"一、" 开头的短行，或不带列表符号、以冒号结尾的短行；数字编号和列表符号开头的行视为要点
+_HEADING = re.compile(r"^(#{1,6}\s*|[一二三四五六七八九十]+[、.]\s*)")
+# 以冒号结尾的行不超过该长度才视为标题，较长的是"某某：说明"形式的正文
+_COLON_HEADING_CHARS = 20
+_BULLET = re.compile(r"^([-*•·]|\d+[.)、])\s*")
+_SENTENCE_END = re.compile(r"(?<=[。！？；.!?;])")
+
+
+# 估算文本的 token 数：安装了 tiktoken 时精确计数，否则按中文一字一个 token、其他字符四个一个 token 估算
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+# 估算一次 LLM 请求的输入 token 数（所有消息内容之和）
+def count_message_tokens(messages) -> int:
+    if isinstance(messages, str):
+        return count_tokens(messages)
+    return sum(count_tokens(str(message.get("content") or "")) for message in messages)
+
+
+def _clean(line: str) -> str:
+    return line.replace("**", "").replace("__", "").strip()
+
+
+def _shorten(point: str) -> str:
+    if count_tokens(point) <= DIGEST_POINT_TOKENS:
+        return point
+    first = _SENTENCE_END.split(point, maxsplit=1)[0]
+    if count_tokens(first) <= DIGEST_POINT_TOKENS:
+        return first
+    # 没有句读的长句按字符截断，按最坏情况一个字符一个 token 计
+    return first[:DIGEST_POINT_TOKENS] + "…"
+
+
+# 将报告拆成 [(标题, [要点])]，要点只保留每条的关键句
+def _sections(report: str) -> list:
+    sections = [["", []]]
+    for raw in report.splitlines():
+        line = _clean(raw)
+        if not line or set(line) <= set("-=*_|: "):
+            continue
+        colon_heading = (len(line) <= _COLON_HEADING_CHARS and line.endswith(("：", ":"))
+                         and not _BULLET.match(line))
+        if len(line) <= 40 and (_HEADING.match(line) or colon_heading):
+            sections.append([_HEADING.sub("", _BULLET.sub("", line)).rstrip("：:"), []])
+            continue
+        sections[-1][1].append(_shorten(_BULLET.sub("", line)))
+    return [(title, points) for title, points in sections if title or points]
+
+
+# 将趋势报告压缩为不超过 budget 个 token 的结构化摘要：标题和要点都计入预算，
+# 要点按轮次分配（先保证每个章节的标题和第一条，再依次补充第二条……），章节的标题在它第一次有内容入选时才计入；
+# 预算用完后不再输出新的章节；报告本身不超预算时原样返回
+def compact_report(report: str, budget: int = TREND_DIGEST_TOKENS) -> str:
+    report = str(report or "")
+    if count_tokens(report) <= budget:
+        return report
+
+    sections = _sections(report)
+    kept = [None] * len(sections)
+    used = 0
+    depth = max((len(points) for _, points in sections), default=0)
+    for round_index in range(max(depth, 1)):
+        for index, (title, points) in enumerate(sections):
+            # 没有要点的章节只在第一轮输出标题
+            if round_index >= len(points) and (round_index > 0 or not title):
+                continue
+            cost = count_tokens(f"- {points[round_index]}\n") if round_index < len(points) else 0
+            if kept[index] is None and title:
+                cost += count_tokens(f"## {title}\n")
+            if used + cost > budget:
+                continue
+            kept[index] = kept[index] or []
+            if round_index < len(points):
+                kept[index].append(points[round_index])
+            used += cost
+
+    lines = []
+    for (title, _), points in zip(sections, kept):
+        if points is None:
+            continue
+        if title:
+            lines.append(f"## {title}")
+        lines.extend(f"- {point}" for point in points)
+    # 逐行估算与整段计数可能略有出入（tiktoken 按整段切分），超出时去掉末尾的行
+    while lines and count_tokens("\n".join(lines)) > budget:
+        lines.pop()
+    return "\n".join(lines)
+
+
+# 按线程累计 LLM 请求的输入 token 数、调用次数和耗时
+# crewai 中每个任务在自己的线程里执行（同步任务依次运行在 kickoff 线程，异步任务各有一个线程），
+# 因此同一线程两次读取之间的累计值就是当前任务的用量
+_usage = local()
+
+
+def record_llm_call(messages, seconds: float):
+    _usage.prompt_tokens = getattr(_usage, "prompt_tokens", 0) + count_message_tokens(messages)
+    _usage.calls = getattr(_usage, "calls", 0) + 1
+    _usage.seconds = getattr(_usage, "seconds", 0.0) + seconds
+
+
+# 记录一次结构化输出的 LLM 重新转换（本地修复失败后才会发生）
+def record_reask():
+    _usage.reasks = getattr(_usage, "reasks", 0) + 1
+
+
+# 读取并清零当前线程的累计用量
+def take_task_usage() -> dict:
+    usage = {
+        "prompt_tokens": getattr(_usage, "prompt_tokens", 0),
+        "llm_calls": getattr(_usage, "calls", 0),
+        "llm_seconds": round(getattr(_usage, "seconds", 0.0), 2),
+        "reasks": getattr(_usage, "reasks", 0),
+    }
+    _usage.prompt_tokens, _usage.calls, _usage.seconds, _usage.reasks = 0, 0, 0.0, 0
+    return usage
+
+
+# 生成任务用量事件文本，由各 crew 的任务回调写入作业事件
+def task_usage_event(task_output) -> str:
+    usage = take_task_usage()
+    name = getattr(task_output, "name", None) or (task_output.description or "")[:30]
+    return (f"Task usage [{name}]: prompt_tokens={usage['prompt_tokens']}, "
+            f"llm_calls={usage['llm_calls']}, llm_seconds={usage['llm_seconds']}, reasks={usage['reasks']}")
+
+
+# 计时执行一次 LLM 调用并记入当前线程的用量
+def metered_call(messages, fn):
+    start = time.monotonic()
+    try:
+        return fn()
+    finally:
+        record_llm_call(messages, time.monotonic() - start)
@@ -1,13 +1,38 @@
 
 import os
-from crewai_tools import BaseTool
+import re
+import hashlib
+import logging
+from functools import lru_cache
+from crewai_tools import BaseTool, ScrapeWebsiteTool
 from tavily import TavilyClient
 from pydantic import PrivateAttr
 from dotenv import load_dotenv
+from utils.cache import SqliteCache
+from utils.rateLimiter import acquire
 
 load_dotenv()
 
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+# 搜索参数，同时参与缓存键的计算
+TAVILY_SEARCH_DEPTH = "advanced"
+TAVILY_MAX_RESULTS = 5
+# 搜索结果缓存的过期时间（秒），趋势类查询在几个小时内变化不大
+TAVILY_CACHE_TTL = float(os.getenv("TAVILY_CACHE_TTL", "21600"))
+
+# 搜索结果缓存，存放在本机 SQLite 文件中，由所有 worker 共享
+_search_cache = SqliteCache("tavily_search", TAVILY_CACHE_TTL)
+
+
+# 规范化查询语句：统一大小写、合并空白、去掉首尾标点，使近似相同的查询命中同一缓存
+def normalize_query(query: str) -> str:
+    query = " ".join(query.lower().split())
+    return re.sub(r"^[\W_]+|[\W_]+$", "", query)
+
+
+# 返回搜索缓存的命中/未命中计数
+def search_cache_stats() -> dict:
+    return _search_cache.stats()
 
 
 class TavilySearchResults(BaseTool):
@@ -28,12 +53,22 @@ class TavilySearchResults(BaseTool):
         self._client = TavilyClient(api_key=api_key)  # 使用 _client
 
     def _run(self, query: str) -> str:
+        normalized = normalize_query(query)
+        cache_key = hashlib.sha256(
+            f"{TAVILY_SEARCH_DEPTH}|{TAVILY_MAX_RESULTS}|{normalized}".encode("utf-8")).hexdigest()
+        cached = _search_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"Tavily cache hit for '{normalized}' ({_search_cache.hits} hits / {_search_cache.misses} misses)")
+            return cached
+
         try:
+            # 只有未命中缓存的查询才消耗限流额度
+            acquire("tavily")
             response = self._client.search(
                 query=query,
-                search_depth="advanced",
+                search_depth=TAVILY_SEARCH_DEPTH,
                 include_answer=True,
-                max_results=5
+                max_results=TAVILY_MAX_RESULTS
             )
             results = []
             for res in response.get("results", []):
@@ -45,7 +80,18 @@ class TavilySearchResults(BaseTool):
             if answer:
                 results.insert(0, f"Tavily AI Answer:\n{answer}\n")
 
-            return "\n\n".join(results) if results else "No relevant results found."
+            output = "\n\n".join(results) if results else "No relevant results found."
+            # 只缓存成功的搜索结果
+            _search_cache.set(cache_key, output)
+            logging.info(f"Tavily cache miss for '{normalized}' ({_search_cache.hits} hits / {_search_cache.misses} misses)")
+            return output
 
         except Exception as e:
-            return f"Error during Tavily search: {str(e)}"
\ No newline at end of file
+            return f"Error during Tavily search: {str(e)}"
+
+
+# 每个 worker 进程共享一组工具实例，避免每个作业、每个 Agent 都重新创建 Tavily 客户端和抓取工具
+# 两个工具都不保存与作业相关的状态，可以在多个线程中同时使用
+@lru_cache(maxsize=None)
+def shared_tools() -> tuple:
+    return TavilySearchResults(), ScrapeWebsiteTool()
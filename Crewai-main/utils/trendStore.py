@@ -0,0 +1,20 @@
+import os
+from utils.cache import SqliteCache, cache_key
+
+# 趋势报告的新鲜度窗口（秒），窗口内相同领域和平台的作业直接复用已有报告
+TREND_REPORT_MAX_AGE = float(os.getenv("TREND_REPORT_MAX_AGE", "86400"))
+# 报告在磁盘上保留的最长时间（秒），读取时再按新鲜度窗口过滤
+TREND_REPORT_TTL = float(os.getenv("TREND_REPORT_TTL", str(7 * 86400)))
+
+# 趋势报告存储，按 (creator_niche, target_platform) 索引，由所有 worker 共享
+_trend_reports = SqliteCache("trend_report", TREND_REPORT_TTL)
+
+
+# 查找新鲜度窗口内的趋势报告，不存在时返回 None
+def get_trend_report(creator_niche: str, target_platform: str, max_age: float = TREND_REPORT_MAX_AGE):
+    return _trend_reports.get(cache_key(creator_niche, target_platform), max_age=max_age)
+
+
+# 保存新生成的趋势报告
+def save_trend_report(creator_niche: str, target_platform: str, report: str):
+    _trend_reports.set(cache_key(creator_niche, target_platform), report)
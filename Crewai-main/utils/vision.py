@@ -0,0 +1,71 @@
+import os
+import base64
+import hashlib
+from dashscope import MultiModalConversation
+from dotenv import load_dotenv
+from utils.cache import LRUCache
+from utils.imaging import normalize_image
+from utils.rateLimiter import acquire
+load_dotenv(override=True)
+
+
+QWEN_VL_API_KEY = os.getenv("QWEN_VL_API_KEY")
+if QWEN_VL_API_KEY:
+    os.environ["DASHSCOPE_API_KEY"] = QWEN_VL_API_KEY
+# 多模态理解使用的模型
+QWEN_VL_MODEL = "qwen-vl-plus"
+IMAGE_PROMPT = "请详细描述这张图片的内容，包括物体、场景、文字、风格等关键信息。"
+# 图片描述缓存的容量和过期时间（秒）
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", "256"))
+IMAGE_CACHE_TTL = float(os.getenv("IMAGE_CACHE_TTL", "86400"))
+
+# 以图片内容哈希为键缓存图片描述，相同图片重复提交时不再调用 VL 模型
+_description_cache = LRUCache(IMAGE_CACHE_SIZE, IMAGE_CACHE_TTL)
+
+
+# 调用 Qwen-VL 多模态 API 理解图片内容，返回图片描述文本
+def describe_image(image_b64: str, mime_type: str = "image/jpeg") -> str:
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"image": f"data:{mime_type};base64,{image_b64}"},
+                {"text": IMAGE_PROMPT}
+            ]
+        }
+    ]
+    acquire("qwen_vl")
+    response = MultiModalConversation.call(
+        model=QWEN_VL_MODEL,
+        messages=messages,
+        api_key=QWEN_VL_API_KEY
+    )
+
+    if response.status_code != 200:
+        raise Exception(f"API Error {response.code}: {response.message}")
+
+    return response.output.choices[0].message.content[0]["text"]
+
+
+# 先按图片字节的哈希查缓存，未命中时调用 VL 模型；返回 (图片描述, 是否命中缓存)
+# mime_type 不为空表示图片已在 API 中规范化，否则（规范化之前入队的作业）在这里规范化
+def describe_image_cached(image_bytes: bytes, mime_type: str = None):
+    key = hashlib.sha256(image_bytes).hexdigest()
+    image_desc = _description_cache.get(key)
+    if image_desc is not None:
+        return image_desc, True
+
+    normalized = image_bytes
+    if mime_type is None:
+        normalized, mime_type = normalize_image(image_bytes)
+    image_desc = describe_image(base64.b64encode(normalized).decode("utf-8"), mime_type)
+    _description_cache.set(key, image_desc)
+    return image_desc, False
+
+
+# 将图片描述与用户原始描述合并为新的创作者领域描述
+def merge_description(creator_niche: str, image_desc: str) -> str:
+    return (
+        f"用户原始描述：{creator_niche}\n\n"
+        f"图片内容分析：{image_desc}"
+    )
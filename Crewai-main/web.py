@@ -3,6 +3,7 @@ import streamlit as st
 import requests
 from PIL import Image
 import io
+import json
 
 # ========== 后端配置 ==========
 BASE_URL = "http://localhost:8012/api/crewai"
@@ -24,6 +25,64 @@ def fetch_job_status(job_id: str):
         return {"exception": str(e)}
 
 
+def cancel_job(job_id: str):
+    """取消指定作业：排队中的作业立即取消，运行中的作业在下一个检查点停止"""
+    try:
+        resp = requests.delete(f"{BASE_URL}/{job_id.strip()}", timeout=10)
+        data = resp.json()
+        if resp.status_code == 200:
+            st.session_state['job_status_map'][job_id] = data.get("status", "CANCELLING")
+        return data
+    except Exception as e:
+        return {"exception": str(e)}
+
+
+def fetch_jobs_status(job_ids):
+    """一次请求批量查询多个任务的状态，并更新全局状态缓存"""
+    try:
+        resp = requests.get(BASE_URL, params={"ids": ",".join(job_ids)}, timeout=10)
+        if resp.status_code != 200:
+            return {"error": f"HTTP {resp.status_code}"}
+        data = resp.json()
+        for job in data.get("jobs", []):
+            st.session_state['job_status_map'][job["job_id"]] = job["status"]
+        return data
+    except Exception as e:
+        for job_id in job_ids:
+            st.session_state['job_status_map'][job_id] = "CONNECTION ERROR"
+        return {"exception": str(e)}
+
+
+def follow_job_stream(job_id: str, placeholder):
+    """订阅作业的推送流 (SSE)，实时展示新事件，直到作业结束"""
+    events = []
+    data = {"job_id": job_id}
+    try:
+        with requests.get(f"{BASE_URL}/{job_id.strip()}/stream", stream=True, timeout=(10, 60)) as resp:
+            if resp.status_code != 200:
+                st.session_state['job_status_map'][job_id] = f"ERROR ({resp.status_code})"
+                return {"error": f"HTTP {resp.status_code}"}
+            event_type = None
+            for line in resp.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event_type = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    payload = json.loads(line[len("data:"):].strip())
+                    st.session_state['job_status_map'][job_id] = payload.get("status", "UNKNOWN")
+                    if event_type == "update":
+                        events.extend(payload.get("events", []))
+                        data = {**payload, "events": events}
+                    elif event_type == "end":
+                        data = {**payload, "events": events}
+                    placeholder.json(data)
+                    if event_type == "end":
+                        break
+        return data
+    except Exception as e:
+        st.session_state['job_status_map'][job_id] = "CONNECTION ERROR"
+        return {"exception": str(e)}
+
+
 # ========== 初始化 session_state ==========
 if 'post_response' not in st.session_state:
     st.session_state['post_response'] = {"message": "尚未提交任务"}
@@ -72,6 +131,8 @@ with st.form("submit_crew", clear_on_submit=False):
                 st.error(f"无法读取图片: {str(e)}")
                 uploaded_file = None
 
+    force_refresh = st.checkbox("忽略已缓存的趋势报告，强制重新调研", value=False)
+
     submitted = st.form_submit_button("启动任务")
 
 if submitted:
@@ -82,7 +143,8 @@ if submitted:
             with st.spinner("正在提交任务到后端..."):
                 form_data = {
                     "target_platform": target_platform,
-                    "creator_niche": creator_niche
+                    "creator_niche": creator_niche,
+                    "force_refresh": str(force_refresh).lower()
                 }
                 files = {"file": (
                 uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)} if uploaded_file else None
@@ -132,6 +194,10 @@ st.header("🔍 查询任务状态")
 if st.session_state['submitted_jobs']:
     st.subheader("📋 已提交的任务")
 
+    if st.button("🔄 刷新全部", help="一次请求刷新所有已提交任务的状态"):
+        st.session_state['get_response'] = fetch_jobs_status(st.session_state['submitted_jobs'])
+        st.rerun()
+
     for jid in st.session_state['submitted_jobs']:
         status = st.session_state['job_status_map'].get(jid, "UNKNOWN")
 
@@ -141,10 +207,14 @@ if st.session_state['submitted_jobs']:
             "STARTED": "🟡",
             "PENDING": "🔵",
             "ERROR": "🔴",
+            "RETRYING": "🟠",
+            "CANCELLING": "🟠",
+            "CANCELLED": "⚫",
+            "TIMEOUT": "🔴",
             "CONNECTION ERROR": "🔴"
         }.get(status, "⚪")
 
-        col_id, col_status, col_btn = st.columns([3, 2, 1])
+        col_id, col_status, col_btn, col_stream, col_cancel = st.columns([3, 2, 1, 1, 1])
 
         with col_id:
             st.code(jid, language="")
@@ -158,6 +228,15 @@ if st.session_state['submitted_jobs']:
                 st.session_state['get_response'] = result
                 st.rerun()  # 刷新页面以更新状态显示
 
+        with col_stream:
+            if st.button("📡", key=f"stream_{jid}", help="实时跟踪此任务进度"):
+                st.session_state['stream_job_id'] = jid
+
+        with col_cancel:
+            if st.button("🛑", key=f"cancel_{jid}", help="取消此任务，释放 worker 和大模型额度"):
+                st.session_state['get_response'] = cancel_job(jid)
+                st.rerun()
+
     st.markdown("---")
 
 # 手动输入查询
@@ -166,6 +245,15 @@ if st.button("查询状态") and job_id_input.strip():
     result = fetch_job_status(job_id_input.strip())
     st.session_state['get_response'] = result
 
+if st.button("实时跟踪") and job_id_input.strip():
+    st.session_state['stream_job_id'] = job_id_input.strip()
+
+# 实时跟踪：服务端有新事件时才推送，不再反复轮询
+if st.session_state.get('stream_job_id'):
+    stream_job_id = st.session_state.pop('stream_job_id')
+    st.subheader(f"📡 实时进度 (GET /api/crewai/{stream_job_id}/stream)")
+    st.session_state['get_response'] = follow_job_stream(stream_job_id, st.empty())
+
 # 显示 GET 响应
 st.subheader("🔍 后端返回 (GET /api/crewai/{job_id})")
 st.json(st.session_state['get_response'])